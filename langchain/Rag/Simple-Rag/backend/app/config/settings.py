@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings
 from pydantic import Field
+from typing import Optional
 
 class Settings(BaseSettings):
     # API
@@ -7,6 +8,8 @@ class Settings(BaseSettings):
     debug: bool = Field(default=False, env="DEBUG")
     host: str = Field(default="0.0.0.0", env="HOST")
     port: int = Field(default=8000, env="PORT")
+    warmup_on_startup: bool = Field(default=True, env="WARMUP_ON_STARTUP")
+    upload_dir: str = Field(default="./data/uploads", env="UPLOAD_DIR")
 
     # LLM
     groq_api_key: str = Field(..., env="GROQ_API_KEY")
@@ -16,6 +19,19 @@ class Settings(BaseSettings):
     pinecone_environment: str = Field(..., env="PINECONE_ENVIRONMENT")
     pinecone_index_name: str = Field(..., env="PINECONE_INDEX_NAME")
 
+    # Vector index: "pinecone" or "local" (quantized, memory-mapped, self-hosted)
+    vector_backend: str = Field(default="pinecone", env="VECTOR_BACKEND")
+    local_vector_dir: str = Field(default="./data/vectors", env="LOCAL_VECTOR_DIR")
+    vector_quantization: str = Field(default="int8", env="VECTOR_QUANTIZATION")  # none, int8, binary
+    vector_rescore_oversample: int = Field(default=4, env="VECTOR_RESCORE_OVERSAMPLE")
+    vector_recall_target: float = Field(default=0.95, env="VECTOR_RECALL_TARGET")
+    vector_compact_ratio: float = Field(default=0.5, env="VECTOR_COMPACT_RATIO")  # dead share that triggers compaction
+
+    # Chunk texts (zstd-compressed, memory-mapped; kept out of vector metadata)
+    chunk_store_dir: str = Field(default="./data/chunks", env="CHUNK_STORE_DIR")
+    chunk_store_compression_level: int = Field(default=3, env="CHUNK_STORE_COMPRESSION_LEVEL")
+    chunk_store_compact_ratio: float = Field(default=0.5, env="CHUNK_STORE_COMPACT_RATIO")  # dead share that triggers compaction
+
     # MongoDB
     mongodb_url: str = Field(..., env="MONGODB_URL")
     mongodb_db_name: str = Field(default="rag_db", env="MONGODB_DB_NAME")
@@ -23,10 +39,56 @@ class Settings(BaseSettings):
     # Redis
     redis_url: str = Field(..., env="REDIS_URL")
     redis_ttl: int = Field(default=3600, env="REDIS_TTL")
+    redis_max_connections: int = Field(default=50, env="REDIS_MAX_CONNECTIONS")
+
+    # Chunking and retrieval (see benchmarks/retrieval_sweep.py)
+    chunk_size: int = Field(default=1000, env="CHUNK_SIZE")
+    chunk_overlap: int = Field(default=200, env="CHUNK_OVERLAP")
+    retrieval_top_k: int = Field(default=5, env="RETRIEVAL_TOP_K")
+    retrieval_score_threshold: float = Field(default=0.5, env="RETRIEVAL_SCORE_THRESHOLD")
+    retrieval_alpha: Optional[float] = Field(default=None, env="RETRIEVAL_ALPHA")  # None = unweighted
+
+    # Per-user warmup of retrieval state when a session starts (services/session_warmup.py)
+    session_warmup_enabled: bool = Field(default=True, env="SESSION_WARMUP_ENABLED")
+    session_warmup_workers: int = Field(default=2, env="SESSION_WARMUP_WORKERS")
+    session_warmup_chats: int = Field(default=3, env="SESSION_WARMUP_CHATS")  # most recent chats prefetched per user
+    session_cache_max_users: int = Field(default=1000, env="SESSION_CACHE_MAX_USERS")
+    session_cache_max_mb: int = Field(default=256, env="SESSION_CACHE_MAX_MB")
+    session_cache_ttl: int = Field(default=300, env="SESSION_CACHE_TTL")
+
+    # Guest tenants: inactive guests are removed from every store by services/guest_reaper.py
+    guest_ttl_hours: int = Field(default=168, env="GUEST_TTL_HOURS")
+    guest_activity_interval: int = Field(default=300, env="GUEST_ACTIVITY_INTERVAL")  # min seconds between last_active_at writes
+    guest_reaper_batch_size: int = Field(default=50, env="GUEST_REAPER_BATCH_SIZE")
+    guest_reaper_batch_pause: float = Field(default=1.0, env="GUEST_REAPER_BATCH_PAUSE")
+    guest_reaper_interval: int = Field(default=3600, env="GUEST_REAPER_INTERVAL")
+
+    # Batch question answering
+    batch_max_concurrency: int = Field(default=8, env="BATCH_MAX_CONCURRENCY")
+    batch_requests_per_second: float = Field(default=5.0, env="BATCH_REQUESTS_PER_SECOND")
+    batch_retrieval_concurrency: int = Field(default=16, env="BATCH_RETRIEVAL_CONCURRENCY")
+
+    # Background ingestion
+    ingest_workers: int = Field(default=2, env="INGEST_WORKERS")
+    ingest_max_jobs_per_user: int = Field(default=1, env="INGEST_MAX_JOBS_PER_USER")
+    ingest_batch_retries: int = Field(default=3, env="INGEST_BATCH_RETRIES")
+    ingest_retry_backoff: float = Field(default=1.0, env="INGEST_RETRY_BACKOFF")
+    ingest_job_timeout: int = Field(default=1800, env="INGEST_JOB_TIMEOUT")
+    ingest_job_ttl: int = Field(default=604800, env="INGEST_JOB_TTL")
+    ingest_requeue_interval: int = Field(default=60, env="INGEST_REQUEUE_INTERVAL")  # stale-job sweep period
 
     # Embeddings
     embedding_model: str = Field(default="sentence-transformers/all-MiniLM-L6-v2", env="EMBEDDING_MODEL")
     embedding_dimension: int = Field(default=384, env="EMBEDDING_DIMENSION")
+    embedding_backend: str = Field(default="torch", env="EMBEDDING_BACKEND")  # "torch" or "onnx"
+    embedding_batch_size: int = Field(default=32, env="EMBEDDING_BATCH_SIZE")
+    embedding_onnx_dir: str = Field(default="./models/onnx", env="EMBEDDING_ONNX_DIR")
+    embedding_onnx_quantize: bool = Field(default=True, env="EMBEDDING_ONNX_QUANTIZE")
+    # Shared embedding server (empty = load the model in every worker)
+    embedding_server_socket: str = Field(default="", env="EMBEDDING_SERVER_SOCKET")
+    embedding_server_authkey: str = Field(default="", env="EMBEDDING_SERVER_AUTHKEY")  # required with a socket
+    embedding_server_max_batch: int = Field(default=64, env="EMBEDDING_SERVER_MAX_BATCH")
+    embedding_server_max_wait_ms: int = Field(default=5, env="EMBEDDING_SERVER_MAX_WAIT_MS")
 
     class Config:
         env_file = ".env"
@@ -1,16 +1,13 @@
 # app/models/models.py
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 from app.config.settings import settings
-from app.db.mongodb import connection
+from app.database.mongodb import connection
+from app.database.redis import get_redis, get_async_redis, run_pipeline, arun_pipeline
 from pydantic import BaseModel, EmailStr
 from datetime import datetime
-import redis
 import json
 import uuid
 
-# Redis client
-redis_client = redis.Redis.from_url(settings.redis_url, decode_responses=True)
-
 class User(BaseModel):
     user_id: str
     username: str
@@ -20,6 +17,7 @@ class User(BaseModel):
     guestTokenLimit: int = 3000
     isPaidUser: bool = False
     created_at: datetime = datetime.utcnow()
+    last_active_at: datetime = datetime.utcnow()
 
 class Chat(BaseModel):
     chat_id: str
@@ -36,49 +34,81 @@ class Document(BaseModel):
     filename: str
     file_path: str
     chunks_count: int
+    chunk_ids: list[str] = []  # content-hash manifest of the document's vectors
     uploaded_at: datetime = datetime.utcnow()
 
 # REDIS CHAT CONTEXT FUNCTIONS
+def chat_key(user_id: str, chat_id: str) -> str:
+    return f"chat:{user_id}:{chat_id}"
+
+def queue_chat_context(pipe, user_id: str, chat_id: str, limit: int = 10):
+    """Queue the chat history read on a pipeline (see format_chat_context)"""
+    return pipe.lrange(chat_key(user_id, chat_id), -limit, -1)
+
+def queue_chat_head(pipe, user_id: str, chat_id: str):
+    """Queue a read of the newest history entry (changes with every saved message)"""
+    return pipe.lindex(chat_key(user_id, chat_id), 0)
+
+def format_chat_context(messages: list) -> str:
+    if not messages:
+        return ""
+    
+    context = ""
+    for msg in messages:
+        msg_data = json.loads(msg)
+        role = msg_data.get("role", "user")
+        content = msg_data.get("content", "")
+        context += f"{role}: {content}\n"
+    
+    return context.strip()
+
 def get_chat_context(user_id: str, chat_id: str, limit: int = 10) -> str:
     """Get recent chat history from Redis"""
     try:
-        chat_key = f"chat:{user_id}:{chat_id}"
-        messages = redis_client.lrange(chat_key, -limit, -1)
-        
-        if not messages:
-            return ""
-        
-        context = ""
-        for msg in messages:
-            msg_data = json.loads(msg)
-            role = msg_data.get("role", "user")
-            content = msg_data.get("content", "")
-            context += f"{role}: {content}\n"
-        
-        return context.strip()
+        messages = get_redis().lrange(chat_key(user_id, chat_id), -limit, -1)
+        return format_chat_context(messages)
+    except Exception as e:
+        print(f"❌ Redis get error: {e}")
+        return ""
+
+async def aget_chat_context(user_id: str, chat_id: str, limit: int = 10) -> str:
+    try:
+        messages = await get_async_redis().lrange(chat_key(user_id, chat_id), -limit, -1)
+        return format_chat_context(messages)
     except Exception as e:
         print(f"❌ Redis get error: {e}")
         return ""
 
+def queue_chat_messages(pipe, user_id: str, chat_id: str, messages: list):
+    """Queue appending [(role, content), ...] to the chat history on a pipeline"""
+    key = chat_key(user_id, chat_id)
+    now = datetime.utcnow().isoformat()
+    for role, content in messages:
+        # Add to Redis list
+        pipe.lpush(key, json.dumps({"role": role, "content": content, "timestamp": now}))
+    
+    # Keep only last 50 messages
+    pipe.ltrim(key, 0, 49)
+    
+    # Set TTL
+    pipe.expire(key, settings.redis_ttl)
+
 def update_chat_context(user_id: str, chat_id: str, role: str, content: str):
     """Add new message to Redis chat context"""
+    return save_chat_messages(user_id, chat_id, [(role, content)])
+
+def save_chat_messages(user_id: str, chat_id: str, messages: list):
+    """Append several messages to the chat context in one round trip"""
     try:
-        chat_key = f"chat:{user_id}:{chat_id}"
-        message = {
-            "role": role,
-            "content": content,
-            "timestamp": datetime.utcnow().isoformat()
-        }
-        
-        # Add to Redis list
-        redis_client.lpush(chat_key, json.dumps(message))
-        
-        # Keep only last 50 messages
-        redis_client.ltrim(chat_key, 0, 49)
-        
-        # Set TTL
-        redis_client.expire(chat_key, settings.redis_ttl)
-        
+        run_pipeline(lambda pipe: queue_chat_messages(pipe, user_id, chat_id, messages))
+        return True
+    except Exception as e:
+        print(f"❌ Redis update error: {e}")
+        return False
+
+async def asave_chat_messages(user_id: str, chat_id: str, messages: list):
+    try:
+        await arun_pipeline(lambda pipe: queue_chat_messages(pipe, user_id, chat_id, messages))
         return True
     except Exception as e:
         print(f"❌ Redis update error: {e}")
@@ -91,7 +121,7 @@ def update_user_tokens(user_id: str, tokens_used: int):
         db = connection()
         result = db.users.update_one(
             {"user_id": user_id},
-            {"$inc": {"tokensUsed": tokens_used}}
+            {"$inc": {"tokensUsed": tokens_used}, "$set": {"last_active_at": datetime.utcnow()}}
         )
         return result.modified_count > 0
     except Exception as e:
@@ -114,6 +144,66 @@ def update_chat_tokens(user_id: str, chat_id: str, tokens_used: int):
         print(f"❌ Chat token update error: {e}")
         return False
 
+def bulk_update_tokens(user_tokens: dict, chat_tokens: dict):
+    """Apply aggregated token usage in one bulk write per collection.
+
+    user_tokens: {user_id: tokens}, chat_tokens: {(user_id, chat_id): tokens}
+    """
+    try:
+        db = connection()
+        now = datetime.utcnow()
+        if user_tokens:
+            db.users.bulk_write([
+                UpdateOne({"user_id": user_id}, {"$inc": {"tokensUsed": tokens}, "$set": {"last_active_at": now}})
+                for user_id, tokens in user_tokens.items()
+            ], ordered=False)
+        if chat_tokens:
+            db.chats.bulk_write([
+                UpdateOne(
+                    {"user_id": user_id, "chat_id": chat_id},
+                    {"$inc": {"chatTokensUsed": tokens}, "$set": {"updated_at": now}}
+                )
+                for (user_id, chat_id), tokens in chat_tokens.items()
+            ], ordered=False)
+        return True
+    except Exception as e:
+        print(f"❌ Bulk token update error: {e}")
+        return False
+
+# ACTIVITY TRACKING (used by services/guest_reaper.py)
+def activity_key(user_id: str) -> str:
+    return f"active:{user_id}"
+
+def touch_user_activity(user_id: str, is_guest: bool = True, create: bool = False):
+    """Record that a user was active; writes to MongoDB at most once per guest_activity_interval.
+
+    With create, a guest without a user record gets one so the reaper can
+    find it later; pass it only for guests that came back (sent X-Guest-ID)
+    or are storing data, not for every anonymous request.
+    """
+    try:
+        if not get_redis().set(activity_key(user_id), 1, nx=True, ex=settings.guest_activity_interval):
+            return False
+        now = datetime.utcnow()
+        defaults = {
+            "username": f"Guest_{user_id[-8:]}",
+            "email": f"{user_id}@guest.local",
+            "tokensUsed": 0,
+            "isGuest": True,
+            "guestTokenLimit": 3000,
+            "isPaidUser": False,
+            "created_at": now,
+        } if is_guest and create else {}
+        connection().users.update_one(
+            {"user_id": user_id},
+            {"$set": {"last_active_at": now}, "$setOnInsert": defaults},
+            upsert=is_guest and create
+        )
+        return True
+    except Exception as e:
+        print(f"❌ Activity update error: {e}")
+        return False
+
 # USER MANAGEMENT FUNCTIONS
 def create_user(user_id: str, username: str = "", email: str = "", is_guest: bool = True):
     """Create a new user in the database"""
@@ -134,7 +224,8 @@ def create_user(user_id: str, username: str = "", email: str = "", is_guest: boo
             "isGuest": is_guest,
             "guestTokenLimit": 3000,
             "isPaidUser": False,
-            "created_at": datetime.utcnow()
+            "created_at": datetime.utcnow(),
+            "last_active_at": datetime.utcnow()
         }
         
         result = db.users.insert_one(user_doc)
@@ -177,6 +268,15 @@ def create_chat(user_id: str, chat_id: str = None, title: str = "New Chat"):
         print(f"❌ Chat creation error: {e}")
         return None
 
+def get_chat(user_id: str, chat_id: str):
+    """Get one chat of a user"""
+    try:
+        db = connection()
+        return db.chats.find_one({"user_id": user_id, "chat_id": chat_id})
+    except Exception as e:
+        print(f"❌ Chat fetch error: {e}")
+        return None
+
 def get_user_chats(user_id: str, limit: int = 50):
     """Get all chats for a user"""
     try:
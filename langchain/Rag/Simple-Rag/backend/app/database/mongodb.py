@@ -1,15 +1,24 @@
 from pymongo import MongoClient
 from app.config.settings import settings
+from app.lazy import Lazy
 from pymongo.errors import ConnectionFailure
 
 
-try:
-    def connection():
-        client = MongoClient(settings.mongodb_url)
-        db = client[settings.mongodb_db_name]
-        print("Connected to MongoDB successfully! ✅✅")
-        return db
+def _connect():
+    # MongoClient is thread-safe and pools connections, so one per process
+    client = MongoClient(settings.mongodb_url)
+    print("Connected to MongoDB successfully! ✅✅")
+    return client
 
-except ConnectionFailure as e:
-    print(f"Could not connect to MongoDB: {e} ❌❌")
-    db = None    
\ No newline at end of file
+mongo_client = Lazy("mongodb", _connect)
+
+def connection():
+    return mongo_client.get()[settings.mongodb_db_name]
+
+def warmup_mongodb():
+    try:
+        mongo_client.get().admin.command("ping")
+        return True
+    except ConnectionFailure as e:
+        print(f"Could not connect to MongoDB: {e} ❌❌")
+        return False
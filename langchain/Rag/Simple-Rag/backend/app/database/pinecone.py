@@ -1,12 +1,48 @@
 from pinecone import Pinecone, PineconeException
 from app.config.settings import settings
-import os
+from app.lazy import Lazy
 
-try:
+
+def _connect():
     # Initialize client (API key can also come from env var)
     pc = Pinecone(api_key=settings.pinecone_api_key, environment=settings.pinecone_environment)
-    indexes = pc.list_indexes()
-    print("✅ Connected to Pinecone! Indexes:", indexes)
+    print("✅ Pinecone client created")
+    return pc
+
+pinecone_client = Lazy("pinecone", _connect, required=lambda: settings.vector_backend != "local")
+
+def _open_index():
+    if settings.vector_backend == "local":
+        from services.vector_store import LocalIndex
+        return LocalIndex(
+            settings.local_vector_dir,
+            settings.embedding_dimension,
+            quantization=settings.vector_quantization,
+            oversample=settings.vector_rescore_oversample,
+            recall_target=settings.vector_recall_target,
+            compact_ratio=settings.vector_compact_ratio,
+        )
+    return get_pinecone().Index(settings.pinecone_index_name)
+
+pinecone_index = Lazy("pinecone_index", _open_index)
+
+def get_pinecone():
+    """Return the shared Pinecone client (created on first use)."""
+    return pinecone_client.get()
+
+def get_index():
+    """Return the shared handle to the configured index (Pinecone or local)."""
+    return pinecone_index.get()
 
-except PineconeException as e:
-    print("❌ Connection to Pinecone failed:", e)
+def warmup_pinecone():
+    """Check connectivity once, outside the request path."""
+    if settings.vector_backend == "local":
+        return get_index() is not None
+    try:
+        indexes = get_pinecone().list_indexes()
+        get_index()
+        print("✅ Connected to Pinecone! Indexes:", indexes)
+        return True
+    except PineconeException as e:
+        print("❌ Connection to Pinecone failed:", e)
+        return False
@@ -1,17 +1,184 @@
+import time
+import threading
+from collections import deque
 import redis
+import redis.asyncio as aioredis
+from redis.client import NEVER_DECODE
 from app.config.settings import settings
+from app.lazy import Lazy
 
-# Creating redis client
-redis_client = redis.Redis.from_url(
-    settings.redis_url,
-    decode_responses=True
-)
+# One access layer for every module: a shared connection pool per process
+# (sync + asyncio), text decoding by default and raw bytes on request
+# (pickles) via NEVER_DECODE, so both codecs share the same connections.
+_BINARY = {NEVER_DECODE: True}
+
+
+class RedisMetrics:
+    """Round trips, commands and latency of calls made through this module"""
+
+    def __init__(self, window: int = 2048):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self.round_trips = 0
+        self.commands = 0
+        self.errors = 0
+
+    def observe(self, seconds: float, commands: int = 1, error: bool = False):
+        with self._lock:
+            self.round_trips += 1
+            self.commands += commands
+            self.errors += int(error)
+            self._latencies.append(seconds * 1000)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                "round_trips": self.round_trips,
+                "commands": self.commands,
+                "errors": self.errors,
+                "commands_per_round_trip": round(self.commands / self.round_trips, 2) if self.round_trips else 0,
+            }
+        if latencies:
+            stats["latency_ms"] = {
+                "p50": round(latencies[len(latencies) // 2], 3),
+                "p95": round(latencies[int(len(latencies) * 0.95) - 1 if len(latencies) > 1 else 0], 3),
+                "max": round(latencies[-1], 3),
+            }
+        return stats
+
+metrics = RedisMetrics()
+
+
+class _TimedRedis(redis.Redis):
+    def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        error = False
+        try:
+            return super().execute_command(*args, **options)
+        except redis.RedisError:
+            error = True
+            raise
+        finally:
+            metrics.observe(time.perf_counter() - started, error=error)
+
+
+class _TimedAsyncRedis(aioredis.Redis):
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        error = False
+        try:
+            return await super().execute_command(*args, **options)
+        except redis.RedisError:
+            error = True
+            raise
+        finally:
+            metrics.observe(time.perf_counter() - started, error=error)
+
+
+redis_client = Lazy("redis", lambda: _TimedRedis(connection_pool=redis.ConnectionPool.from_url(
+    settings.redis_url, decode_responses=True, max_connections=settings.redis_max_connections
+)))
+# asyncio pools are bound to the event loop that first uses them
+redis_async_client = Lazy("redis_async", lambda: _TimedAsyncRedis(connection_pool=aioredis.ConnectionPool.from_url(
+    settings.redis_url, decode_responses=True, max_connections=settings.redis_max_connections
+)), required=False)
+
+def get_redis():
+    """Return the shared (pooled) sync Redis client."""
+    return redis_client.get()
+
+def get_async_redis():
+    """Return the shared (pooled) asyncio Redis client."""
+    return redis_async_client.get()
+
+def warmup_redis():
+    try:
+        return get_redis().ping()
+    except redis.RedisError as e:
+        print(f"❌ Redis connection failed: {e}")
+        return False
+
+# Binary values (e.g. pickled encoders)
+def get_bytes(key: str):
+    return get_redis().execute_command("GET", key, **_BINARY)
+
+def set_bytes(key: str, value: bytes, ttl: int = None, persist: bool = False):
+    """persist=True stores the value without a TTL (state that is expensive to rebuild)"""
+    get_redis().set(key, value, ex=None if persist else ttl or settings.redis_ttl)
+
+async def aget_bytes(key: str):
+    return await get_async_redis().execute_command("GET", key, **_BINARY)
+
+def queue_get_bytes(pipe, key: str):
+    """Queue a binary GET on a pipeline (sync or async)"""
+    return pipe.execute_command("GET", key, **_BINARY)
+
+# Pipelining: build() queues commands, everything goes in one round trip
+def run_pipeline(build) -> list:
+    pipe = get_redis().pipeline(transaction=False)
+    build(pipe)
+    commands = len(pipe.command_stack)  # execute() resets the stack
+    started = time.perf_counter()
+    error = False
+    try:
+        return pipe.execute()
+    except redis.RedisError:
+        error = True
+        raise
+    finally:
+        metrics.observe(time.perf_counter() - started, commands=commands, error=error)
+
+async def arun_pipeline(build) -> list:
+    pipe = get_async_redis().pipeline(transaction=False)
+    build(pipe)
+    commands = len(pipe.command_stack)
+    started = time.perf_counter()
+    error = False
+    try:
+        return await pipe.execute()
+    except redis.RedisError:
+        error = True
+        raise
+    finally:
+        metrics.observe(time.perf_counter() - started, commands=commands, error=error)
+
+def _pool_stats(pool) -> dict:
+    if pool is None:
+        return {}
+    return {
+        "max_connections": pool.max_connections,
+        "created": getattr(pool, "_created_connections", None),
+        "idle": len(getattr(pool, "_available_connections", [])),
+        "in_use": len(getattr(pool, "_in_use_connections", [])),
+    }
+
+def redis_metrics() -> dict:
+    """Round-trip/latency counters plus connection pool usage"""
+    return {
+        **metrics.snapshot(),
+        "pool": _pool_stats(redis_client.get().connection_pool if redis_client.ready else None),
+        "async_pool": _pool_stats(redis_async_client.get().connection_pool if redis_async_client.ready else None),
+    }
+
+# Cross-process mutex for read-modify-write of shared keys (token-checked release)
+def redis_lock(name: str, timeout: float = 60, wait: float = 30):
+    """Usage: with redis_lock("bm25:<user>"): ... (raises LockError if not acquired in `wait` s)"""
+    return get_redis().lock(f"lock:{name}", timeout=timeout, blocking_timeout=wait)
 
 # Simple helper function to set and get cache
 def set_cache(key: str, value: str, ttl: int = None):
     """Set a value in Redis with optional TTL (defaults to settings.redis_ttl)."""
-    redis_client.set(key, value, ex=ttl or settings.redis_ttl)
+    get_redis().set(key, value, ex=ttl or settings.redis_ttl)
 
 def get_cache(key: str):
     """Get a value from Redis by key."""
-    return redis_client.get(key)
+    return get_redis().get(key)
+
+# Namespace versions: bumped whenever a user's documents change, so any
+# cache keyed on (namespace, version) stops matching. Never expires.
+def get_namespace_version(namespace: str) -> int:
+    return int(get_redis().get(f"nsver:{namespace}") or 0)
+
+def bump_namespace_version(namespace: str) -> int:
+    return get_redis().incr(f"nsver:{namespace}")
@@ -0,0 +1,70 @@
+# app/lazy.py
+import threading
+import time
+
+# Every lazily created component, by name (used by the readiness endpoint)
+registry = {}
+
+
+class Lazy:
+    """Thread-safe, lazily initialized singleton.
+
+    The factory runs on the first call to get(), never at import time,
+    so forked workers start fast and an unreachable service only fails
+    the request that needs it.
+    """
+
+    def __init__(self, name: str, factory, required=True):
+        self.name = name
+        self._factory = factory
+        # bool, or a callable deciding at runtime (e.g. from settings)
+        self._required = required
+        self._lock = threading.Lock()
+        self._value = None
+        self._ready = False
+        self.load_seconds = None
+        self.error = None
+        registry[name] = self
+
+    def get(self):
+        if self._ready:
+            return self._value
+        with self._lock:
+            if not self._ready:
+                started = time.perf_counter()
+                try:
+                    self._value = self._factory()
+                except Exception as e:
+                    self.error = str(e)
+                    raise
+                self.load_seconds = round(time.perf_counter() - started, 3)
+                self.error = None
+                self._ready = True
+        return self._value
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    def reset(self):
+        """Drop the instance so the next get() builds a new one."""
+        with self._lock:
+            self._value = None
+            self._ready = False
+
+    @property
+    def required(self) -> bool:
+        return self._required() if callable(self._required) else self._required
+
+    def status(self) -> dict:
+        return {
+            "ready": self._ready,
+            "required": self.required,
+            "load_seconds": self.load_seconds,
+            "error": self.error,
+        }
+
+
+def readiness() -> dict:
+    """Report which registered components are warm."""
+    return {name: component.status() for name, component in registry.items()}
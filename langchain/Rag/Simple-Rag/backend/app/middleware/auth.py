@@ -3,6 +3,7 @@ from fastapi import Request, HTTPException, Depends
 from fastapi_clerk_auth import ClerkConfig, ClerkHTTPBearer, HTTPAuthorizationCredentials
 import uuid
 from typing import Optional
+from services.session_warmup import prefetch_session
 
 # ⚠️ REPLACE with your actual Clerk frontend URL when ready
 # Get this from: https://dashboard.clerk.com -> Your App -> API Keys
@@ -70,6 +71,7 @@ def determine_user_identity(request: Request, identity: dict = None) -> tuple:
     """
     if identity and identity.get("is_logged_in"):
         # Authenticated user via Clerk
+        prefetch_session(identity["user_id"])
         return (
             identity["user_id"],
             False,  # is_guest
@@ -80,6 +82,9 @@ def determine_user_identity(request: Request, identity: dict = None) -> tuple:
     else:
         # Guest user
         guest_info = get_user_identity(request)
+        if request.headers.get("X-Guest-ID"):
+            # Returning guest (a freshly generated ID has nothing to warm)
+            prefetch_session(guest_info["user_id"])
         return (
             guest_info["user_id"],
             True,  # is_guest
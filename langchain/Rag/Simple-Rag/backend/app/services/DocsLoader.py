@@ -1,10 +1,22 @@
 from langchain_community.document_loaders import TextLoader, PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from app.db.pinecone_db import get_pinecone
+from app.database.pinecone import get_index
 from services.embeddings import generate_embedding_docs
-from services.search import train_bm25_for_user
+from services.search import update_bm25_for_user, fetch_chunk_texts
+from services.chunk_store import get_chunk_store
+from app.database.redis import bump_namespace_version, redis_lock
+from app.database.models.models import Document
+from app.config.settings import settings
+import hashlib
+import os
+import time
 import uuid
 from datetime import datetime
+from redis.exceptions import LockError
+
+EMBED_BATCH_SIZE = 64
+UPSERT_BATCH_SIZE = 100
+DELETE_BATCH_SIZE = 1000
 
 def docs_loader(file_path: str):
     if file_path.endswith('.txt'):
@@ -15,61 +27,216 @@ def docs_loader(file_path: str):
         raise ValueError("❌ File format not supported (only .txt or .pdf)")
     return loader.load()
 
-def split_docs(documents, chunk_size=1000, chunk_overlap=200):
+def split_docs(documents, chunk_size=None, chunk_overlap=None):
+    chunk_size = chunk_size or settings.chunk_size
+    chunk_overlap = settings.chunk_overlap if chunk_overlap is None else chunk_overlap
     splitter = RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
     )
     return splitter.split_documents(documents)
 
-def store_docs_in_pinecone(user_id: str, file_path: str):
-    """Store documents with user isolation and BM25 training"""
+def normalize_chunk_text(text: str) -> str:
+    """Collapse whitespace so re-extracted text hashes the same"""
+    return " ".join(text.split())
+
+def make_chunk_id(user_id: str, filename: str, text: str) -> str:
+    """Deterministic chunk ID from (user, filename, normalized content)"""
+    key = "\x00".join([user_id, filename, normalize_chunk_text(text)])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def batched(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def with_retries(func, *args, retries: int = None, backoff: float = None):
+    """Call func, retrying with exponential backoff (for embedding/upsert batches)"""
+    retries = settings.ingest_batch_retries if retries is None else retries
+    backoff = settings.ingest_retry_backoff if backoff is None else backoff
+    for attempt in range(retries + 1):
+        try:
+            return func(*args)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = backoff * 2 ** attempt
+            print(f"⚠️ Batch failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+def document_lock(user_id: str, doc_id: str, wait: float = 30):
+    """Cross-process lock around one document's manifest -> vectors -> record update.
+
+    Ingestion jobs (workers) and deletes (API) of the same document take
+    it, so a delete cannot be undone by a job that read the manifest
+    before it. Holders of long work call reacquire() to keep it.
+    """
+    return redis_lock(f"doc:{user_id}:{doc_id}", timeout=settings.ingest_job_timeout, wait=wait)
+
+def store_docs_in_pinecone(user_id: str, file_path: str, doc_id: str = None, progress=None):
+    """Store documents with user isolation and BM25 training.
+
+    Chunk IDs are content hashes and every document keeps a manifest of
+    them, so re-ingesting a file only embeds/upserts the new chunks and
+    deletes the ones that disappeared. Pass doc_id to replace a specific
+    document (otherwise it is matched by filename). progress, if given,
+    is called with running counts (pages_parsed, chunks_total,
+    chunks_embedded, vectors_upserted). Runs under the document's
+    document_lock from the manifest read to the record write.
+    """
     try:
-        pc = get_pinecone()
-        index = pc.Index(settings.pinecone_index_name)
+        from app.database.mongodb import connection
+
+        index = get_index()
+        chunk_store = get_chunk_store(user_id)
+        db = connection()
+        filename = os.path.basename(file_path)
+        
+        progress = progress or (lambda **counts: None)
         
         docs = docs_loader(file_path)
+        progress(pages_parsed=len(docs))
         chunks = split_docs(docs)
         
-        texts = [chunk.page_content for chunk in chunks]
-        embeddings = generate_embedding_docs(texts)
+        # Identical chunks within a file collapse into one vector
+        chunk_map = {}
+        for i, chunk in enumerate(chunks):
+            chunk_id = make_chunk_id(user_id, filename, chunk.page_content)
+            chunk_map.setdefault(chunk_id, (i, chunk.page_content))
         
-        # Train BM25 for this user with new texts
-        train_bm25_for_user(user_id, texts)
+        # Which document this is; a new file gets a fresh id
+        if doc_id:
+            target_id = doc_id
+        else:
+            existing = db.documents.find_one({"user_id": user_id, "filename": filename}, {"doc_id": 1})
+            target_id = existing["doc_id"] if existing else str(uuid.uuid4())
         
-        vectors = []
-        for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-            chunk_id = str(uuid.uuid4())
-            vectors.append((
-                chunk_id,
-                embedding,
-                {
-                    "user_id": user_id,
-                    "filename": file_path.split("/")[-1],
-                    "chunk_index": i,
-                    "text": chunk.page_content,
-                    "created_at": datetime.utcnow().isoformat()
-                }
-            ))
+        lock = document_lock(user_id, target_id, wait=settings.ingest_job_timeout)
+        with lock:
+            def report(**counts):
+                lock.reacquire()  # keeps the lock for as long as the job makes progress
+                progress(**counts)
+            
+            # Diff against the manifest from the previous ingest of this file
+            # (re-read under the lock: a delete may have removed it since)
+            manifest = db.documents.find_one({"user_id": user_id, "doc_id": target_id}, {"doc_id": 1, "chunk_ids": 1})
+            if doc_id and not manifest:
+                return {"error": f"❌ Document {doc_id} not found"}
+            existing_ids = set(manifest.get("chunk_ids", [])) if manifest else set()
+            new_ids = [cid for cid in chunk_map if cid not in existing_ids]
+            stale_ids = [cid for cid in existing_ids if cid not in chunk_map]
+            report(chunks_total=len(new_ids))
         
-        # Store in user's namespace
-        index.upsert(vectors=vectors, namespace=user_id)
+            texts = [chunk_map[cid][1] for cid in new_ids]
+            stale_texts = list(fetch_chunk_texts(user_id, stale_ids).values()) if stale_ids else []
         
-        # Update document count in MongoDB
-        from app.models import Document
-        from app.db.mongodb import connection
+            created_at = datetime.utcnow().isoformat()
+            embedded = upserted = 0
+            for batch_ids in batched(new_ids, EMBED_BATCH_SIZE):
+                batch_texts = [chunk_map[cid][1] for cid in batch_ids]
+                embeddings = with_retries(generate_embedding_docs, batch_texts)
+                embedded += len(batch_ids)
+                report(chunks_embedded=embedded)
+            
+                # Text lives in the chunk store; metadata keeps only small fields
+                chunk_store.put_many({cid: chunk_map[cid][1] for cid in batch_ids})
+            
+                vectors = []
+                for chunk_id, embedding in zip(batch_ids, embeddings):
+                    vectors.append((
+                        chunk_id,
+                        embedding,
+                        {
+                            "user_id": user_id,
+                            "filename": filename,
+                            "chunk_index": chunk_map[chunk_id][0],
+                            "created_at": created_at
+                        }
+                    ))
+            
+                # Store in user's namespace
+                for batch in batched(vectors, UPSERT_BATCH_SIZE):
+                    with_retries(lambda b: index.upsert(vectors=b, namespace=user_id), batch)
+                    upserted += len(batch)
+                    report(vectors_upserted=upserted)
         
-        db = connection()
-        doc_record = Document(
-            doc_id=str(uuid.uuid4()),
-            user_id=user_id,
-            filename=file_path.split("/")[-1],
-            file_path=file_path,
-            chunks_count=len(chunks)
-        )
-        db.documents.insert_one(doc_record.dict())
+            for batch in batched(stale_ids, DELETE_BATCH_SIZE):
+                index.delete(ids=batch, namespace=user_id)
+            chunk_store.delete_many(stale_ids)
         
-        return {"message": f"✅ Stored {len(chunks)} chunks for {file_path}"}
+            # Update document record and its chunk manifest in MongoDB
+            doc_record = Document(
+                doc_id=target_id,
+                user_id=user_id,
+                filename=filename,
+                file_path=file_path,
+                chunks_count=len(chunk_map),
+                chunk_ids=list(chunk_map),
+                uploaded_at=datetime.utcnow()
+            )
+            db.documents.replace_one(
+                {"user_id": user_id, "doc_id": doc_record.doc_id},
+                doc_record.dict(),
+                upsert=True
+            )
         
+            # BM25 statistics change only once vectors and manifest are in place,
+            # so a failed batch can be retried without counting texts twice
+            if texts or stale_texts:
+                update_bm25_for_user(user_id, texts, stale_texts)
+        
+            if new_ids or stale_ids:
+                bump_namespace_version(user_id)
+        
+            unchanged = len(chunk_map) - len(new_ids)
+            return {
+                "message": f"✅ Stored {len(chunk_map)} chunks for {file_path} "
+                           f"({len(new_ids)} new, {unchanged} unchanged, {len(stale_ids)} removed)",
+                "doc_id": doc_record.doc_id
+            }
+        
+    except Exception as e:
+        return {"error": f"❌ Failed to store documents: {str(e)}"}
+
+def delete_document(user_id: str, doc_id: str):
+    """Remove one document's vectors, BM25 statistics and record.
+
+    Cost is proportional to the document, not the tenant. Waits for an
+    ingestion job of the same document to finish (document_lock).
+    """
+    try:
+        from app.database.mongodb import connection
+
+        with document_lock(user_id, doc_id):
+            return _delete_document(get_index(), connection(), user_id, doc_id)
+        
+    except LockError:
+        return {"error": f"❌ Document {doc_id} is being ingested, try again shortly"}
     except Exception as e:
-        return {"error": f"❌ Failed to store documents: {str(e)}"}
\ No newline at end of file
+        return {"error": f"❌ Failed to delete document: {str(e)}"}
+
+def _delete_document(index, db, user_id: str, doc_id: str):
+    doc = db.documents.find_one({"user_id": user_id, "doc_id": doc_id})
+    if not doc:
+        return {"error": f"❌ Document {doc_id} not found"}
+    
+    chunk_ids = doc.get("chunk_ids", [])
+    removed_texts = list(fetch_chunk_texts(user_id, chunk_ids).values())
+    
+    if chunk_ids:
+        for batch in batched(chunk_ids, DELETE_BATCH_SIZE):
+            index.delete(ids=batch, namespace=user_id)
+    else:
+        # Documents ingested before chunk manifests existed
+        # (delete by metadata filter needs a pod-based index)
+        index.delete(filter={"filename": doc["filename"]}, namespace=user_id)
+    
+    get_chunk_store(user_id).delete_many(chunk_ids)
+    db.documents.delete_one({"user_id": user_id, "doc_id": doc_id})
+    update_bm25_for_user(user_id, removed_texts=removed_texts)
+    bump_namespace_version(user_id)
+    
+    return {"message": f"✅ Deleted {doc['filename']} ({len(chunk_ids)} chunks)", "doc_id": doc_id}
+
+def replace_document(user_id: str, doc_id: str, file_path: str):
+    """Replace a document's content, re-embedding only the chunks that changed"""
+    return store_docs_in_pinecone(user_id, file_path, doc_id=doc_id)
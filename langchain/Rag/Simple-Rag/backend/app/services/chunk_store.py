@@ -0,0 +1,299 @@
+# services/chunk_store.py
+"""
+Local store for chunk texts, so vector metadata only carries IDs and
+small fields.
+
+Each namespace directory holds:
+    data.bin    append-only zstandard frames, one per chunk (memory-mapped)
+    index.bin   fixed 44-byte records: sha256(chunk_id), offset, length
+                (length 0 marks a deleted chunk; later records win)
+    CURRENT     generation number once the store has been compacted;
+                generation N uses data.N.bin / index.N.bin
+
+Writers (ingestion workers) append under a file lock; readers in other
+processes pick up new records when index.bin grows and switch files when
+CURRENT changes. Deletes and replacements leave dead frames behind, so a
+write that pushes the dead share of data.bin past
+chunk_store_compact_ratio rewrites the live frames into a new generation.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import shutil
+import struct
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import zstandard as zstd
+from app.config.settings import settings
+
+RECORD = struct.Struct("<32sQI")
+MAX_OPEN_STORES = 256
+COMPACT_MIN_BYTES = 1 << 20  # never bother compacting stores smaller than this
+
+
+def _key(chunk_id: str) -> bytes:
+    return hashlib.sha256(chunk_id.encode("utf-8")).digest()
+
+
+class ChunkStore:
+    def __init__(self, path: str, level: int = 3, compact_ratio: float = 0.5):
+        self.path = path
+        self.compact_ratio = compact_ratio
+        os.makedirs(path, exist_ok=True)
+        self._current_path = os.path.join(path, "CURRENT")
+        self._lock_path = os.path.join(path, "lock")
+
+        self._compressor = zstd.ZstdCompressor(level=level)
+        self._decompressor = zstd.ZstdDecompressor()
+        self._lock = threading.RLock()
+        self._generation = None
+        self._current_inode = None
+        self._current_generation = 0
+        self._entries = {}
+        self._live_bytes = 0
+        self._index_size = 0
+        self._mmap = None
+        self._mmap_size = 0
+        with self._file_lock():
+            self._refresh()
+            for file_path in (self._data_path, self._index_path):
+                open(file_path, "ab").close()
+
+    # ---------- generations ----------
+
+    def _files(self, generation: int):
+        if generation == 0:
+            return os.path.join(self.path, "data.bin"), os.path.join(self.path, "index.bin")
+        return (os.path.join(self.path, f"data.{generation}.bin"),
+                os.path.join(self.path, f"index.{generation}.bin"))
+
+    def _read_generation(self) -> int:
+        try:
+            inode = os.stat(self._current_path).st_ino
+        except FileNotFoundError:
+            return 0
+        if inode != self._current_inode:
+            with open(self._current_path) as f:
+                self._current_inode = inode
+                self._current_generation = int(f.read().strip() or 0)
+        return self._current_generation
+
+    def _switch(self, generation: int):
+        self._generation = generation
+        self._data_path, self._index_path = self._files(generation)
+        self._entries = {}
+        self._live_bytes = 0
+        self._index_size = 0
+        self._close_mmap()
+
+    @contextmanager
+    def _file_lock(self):
+        """Cross-process writer lock (appends and compaction)"""
+        with open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # ---------- reading ----------
+
+    def _refresh(self):
+        """Load index records appended since the last refresh (by any process)"""
+        for _ in range(3):
+            generation = self._read_generation()
+            if generation != self._generation:
+                self._switch(generation)
+            try:
+                size = os.path.getsize(self._index_path)
+            except FileNotFoundError:
+                # Compacted away between reading CURRENT and opening the index
+                self._current_inode = None
+                continue
+            break
+        else:
+            return
+
+        if size > self._index_size:
+            with open(self._index_path, "rb") as f:
+                f.seek(self._index_size)
+                tail = f.read(size - self._index_size)
+            usable = len(tail) - len(tail) % RECORD.size  # ignore a half-written record
+            for key, offset, length in RECORD.iter_unpack(tail[:usable]):
+                old = self._entries.pop(key, None)
+                if old:
+                    self._live_bytes -= old[1]
+                if length:
+                    self._entries[key] = (offset, length)
+                    self._live_bytes += length
+            self._index_size += usable
+
+    def _close_mmap(self):
+        if self._mmap is not None:
+            self._mmap.close()
+        self._mmap = None
+        self._mmap_size = 0
+
+    def _data(self):
+        try:
+            size = os.path.getsize(self._data_path)
+        except FileNotFoundError:
+            # Compacted meanwhile: the old mapping still matches our entries
+            return self._mmap
+        if size and size != self._mmap_size:
+            self._close_mmap()
+            with open(self._data_path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mmap_size = size
+        return self._mmap
+
+    # ---------- writing ----------
+
+    def _append(self, records: list, payload: bytes = b""):
+        with self._file_lock():
+            self._refresh()  # a compaction may have switched files
+            with open(self._data_path, "ab") as f:
+                base = f.tell()
+                f.write(payload)
+            with open(self._index_path, "ab") as f:
+                f.write(b"".join(
+                    RECORD.pack(key, base + offset if length else 0, length)
+                    for key, offset, length in records
+                ))
+
+    def dead_ratio(self) -> float:
+        """Share of data.bin taken by deleted or replaced frames"""
+        with self._lock:
+            self._refresh()
+            size = os.path.getsize(self._data_path) if os.path.exists(self._data_path) else 0
+            return 1 - self._live_bytes / size if size else 0.0
+
+    def _maybe_compact(self):
+        size = os.path.getsize(self._data_path)
+        if size >= COMPACT_MIN_BYTES and 1 - self._live_bytes / size > self.compact_ratio:
+            self.compact()
+
+    def compact(self) -> int:
+        """Rewrite the live frames into a new generation; returns the bytes reclaimed"""
+        with self._lock, self._file_lock():
+            self._refresh()
+            data = self._data()
+            old_files = (self._data_path, self._index_path)
+            old_size = os.path.getsize(self._data_path)
+            generation = self._generation + 1
+            data_path, index_path = self._files(generation)
+
+            offset = 0
+            with open(data_path, "wb") as data_file, open(index_path, "wb") as index_file:
+                # File order keeps both the read and the write sequential
+                for key, (old_offset, length) in sorted(self._entries.items(), key=lambda item: item[1]):
+                    data_file.write(data[old_offset:old_offset + length])
+                    index_file.write(RECORD.pack(key, offset, length))
+                    offset += length
+                for f in (data_file, index_file):
+                    f.flush()
+                    os.fsync(f.fileno())
+
+            tmp_path = self._current_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                f.write(str(generation))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._current_path)
+
+            self._refresh()
+            for file_path in old_files:
+                os.remove(file_path)
+            return old_size - offset
+
+    def put_many(self, chunks: dict):
+        """Store {chunk_id: text}"""
+        if not chunks:
+            return
+        records, frames, offset = [], [], 0
+        for chunk_id, text in chunks.items():
+            frame = self._compressor.compress(text.encode("utf-8"))
+            records.append((_key(chunk_id), offset, len(frame)))
+            frames.append(frame)
+            offset += len(frame)
+        with self._lock:
+            self._append(records, b"".join(frames))
+            self._refresh()
+            self._maybe_compact()
+
+    def get_many(self, chunk_ids: list) -> dict:
+        """Batched multi-get: {chunk_id: text} for the IDs that exist"""
+        with self._lock:
+            self._refresh()
+            located = []
+            for chunk_id in chunk_ids:
+                entry = self._entries.get(_key(chunk_id))
+                if entry:
+                    located.append((entry[0], entry[1], chunk_id))
+            if not located:
+                return {}
+
+            data = self._data()
+            texts = {}
+            # Read in file order so page-ins stay sequential
+            for offset, length, chunk_id in sorted(located):
+                texts[chunk_id] = self._decompressor.decompress(data[offset:offset + length]).decode("utf-8")
+            return texts
+
+    def delete_many(self, chunk_ids: list):
+        if not chunk_ids:
+            return
+        with self._lock:
+            self._append([(_key(chunk_id), 0, 0) for chunk_id in chunk_ids])
+            self._refresh()
+            self._maybe_compact()
+
+    def iter_texts(self):
+        """All live chunk texts in the namespace"""
+        with self._lock:
+            self._refresh()
+            entries = sorted(self._entries.values())
+            data = self._data()
+            for offset, length in entries:
+                yield self._decompressor.decompress(data[offset:offset + length]).decode("utf-8")
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._entries)
+
+    def close(self):
+        with self._lock:
+            self._close_mmap()
+
+
+_stores = OrderedDict()
+_stores_lock = threading.Lock()
+
+def _namespace_path(namespace: str) -> str:
+    return os.path.join(settings.chunk_store_dir, namespace or "_default")
+
+def get_chunk_store(namespace: str) -> ChunkStore:
+    """Open (or reuse) the chunk store of a namespace; keeps at most MAX_OPEN_STORES open"""
+    with _stores_lock:
+        store = _stores.get(namespace)
+        if store is None:
+            store = ChunkStore(_namespace_path(namespace), settings.chunk_store_compression_level,
+                               settings.chunk_store_compact_ratio)
+            _stores[namespace] = store
+            if len(_stores) > MAX_OPEN_STORES:
+                _, evicted = _stores.popitem(last=False)
+                evicted.close()
+        else:
+            _stores.move_to_end(namespace)
+        return store
+
+def drop_chunk_store(namespace: str):
+    """Delete every chunk of a namespace"""
+    with _stores_lock:
+        store = _stores.pop(namespace, None)
+        if store is not None:
+            store.close()
+    shutil.rmtree(_namespace_path(namespace), ignore_errors=True)
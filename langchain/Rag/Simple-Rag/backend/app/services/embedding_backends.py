@@ -0,0 +1,154 @@
+# services/embedding_backends.py
+"""
+Embedding backends selected by settings.embedding_backend:
+
+- "torch": sentence-transformers model on full-precision torch (default)
+- "onnx":  the same model exported to ONNX Runtime, optionally with
+           dynamic int8 quantization, for CPU-only nodes
+"""
+import os
+import numpy as np
+
+
+class TorchBackend:
+    name = "torch"
+
+    def __init__(self, model_name: str):
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        self.model_name = model_name
+        self.model = HuggingFaceEmbeddings(model_name=model_name)
+
+    def embed_documents(self, texts: list[str]):
+        return self.model.embed_documents(texts)
+
+    def embed_query(self, text: str):
+        return self.model.embed_query(text)
+
+
+class OnnxBackend:
+    name = "onnx"
+
+    def __init__(self, model_name: str, cache_dir: str, quantize: bool = True,
+                 batch_size: int = 32, max_length: int = 256):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("The onnx embedding backend needs onnxruntime (pip install onnxruntime)")
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+        model_dir = os.path.join(cache_dir, model_name.replace("/", "__"))
+        self.model_path = self._prepare_model(model_dir, quantize)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _prepare_model(self, model_dir: str, quantize: bool) -> str:
+        """Export the model to ONNX (and quantize it) once, then reuse the files"""
+        fp32_path = os.path.join(model_dir, "model.onnx")
+        int8_path = os.path.join(model_dir, "model.int8.onnx")
+
+        if not os.path.exists(fp32_path):
+            self._export(fp32_path)
+        if not quantize:
+            return fp32_path
+
+        if not os.path.exists(int8_path):
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+        return int8_path
+
+    def _export(self, path: str):
+        import torch
+        from transformers import AutoModel
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        model = AutoModel.from_pretrained(self.model_name)
+        model.eval()
+
+        dummy = self.tokenizer(["warmup text"], return_tensors="pt")
+        # Positional order must follow the model's forward() signature
+        names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in dummy]
+        dynamic = {n: {0: "batch", 1: "sequence"} for n in names}
+        dynamic["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                tuple(dummy[n] for n in names),
+                path,
+                input_names=names,
+                output_names=["last_hidden_state"],
+                dynamic_axes=dynamic,
+                opset_version=14,
+            )
+
+    def _embed_batch(self, texts: list[str]) -> np.ndarray:
+        encoded = self.tokenizer(
+            texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np"
+        )
+        inputs = {k: v.astype(np.int64) for k, v in encoded.items() if k in self.input_names}
+        hidden = self.session.run(None, inputs)[0]
+
+        # Mean pooling + L2 normalization, as in sentence-transformers
+        mask = encoded["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return pooled / np.clip(norms, 1e-12, None)
+
+    def embed_documents(self, texts: list[str]):
+        if not texts:
+            return []
+        vectors = [
+            self._embed_batch(texts[i:i + self.batch_size])
+            for i in range(0, len(texts), self.batch_size)
+        ]
+        return np.vstack(vectors).tolist()
+
+    def embed_query(self, text: str):
+        return self.embed_documents([text])[0]
+
+
+def create_embedding_backend(settings, backend: str = None):
+    """Build the configured backend and check it matches the index dimension"""
+    backend = backend or settings.embedding_backend
+    if backend == "torch":
+        model = TorchBackend(settings.embedding_model)
+    elif backend == "onnx":
+        model = OnnxBackend(
+            settings.embedding_model,
+            settings.embedding_onnx_dir,
+            quantize=settings.embedding_onnx_quantize,
+            batch_size=settings.embedding_batch_size,
+        )
+    else:
+        raise ValueError(f"❌ Unknown embedding backend: {backend} (expected 'torch' or 'onnx')")
+
+    dimension = len(model.embed_query("dimension check"))
+    if dimension != settings.embedding_dimension:
+        raise ValueError(
+            f"❌ Embedding backend '{backend}' returns {dimension}-dim vectors, "
+            f"but embedding_dimension is {settings.embedding_dimension}"
+        )
+    return model
+
+
+def parity_check(reference, candidate, texts: list[str]) -> dict:
+    """Cosine similarity between two backends' embeddings of the same texts"""
+    a = np.asarray(reference.embed_documents(texts), dtype=np.float32)
+    b = np.asarray(candidate.embed_documents(texts), dtype=np.float32)
+    a /= np.clip(np.linalg.norm(a, axis=1, keepdims=True), 1e-12, None)
+    b /= np.clip(np.linalg.norm(b, axis=1, keepdims=True), 1e-12, None)
+    cosine = (a * b).sum(axis=1)
+    return {
+        "texts": len(texts),
+        "mean_cosine": float(cosine.mean()),
+        "min_cosine": float(cosine.min()),
+        "p05_cosine": float(np.percentile(cosine, 5)),
+    }
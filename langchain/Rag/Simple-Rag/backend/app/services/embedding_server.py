@@ -0,0 +1,185 @@
+# services/embedding_server.py
+"""
+Shared embedding process for multi-worker deployments.
+
+One process owns the model and serves every API worker over a Unix
+socket, batching concurrent requests together. Start it from the
+backend directory (modules import both app.* and services.*) with
+
+    PYTHONPATH=.:app python -m services.embedding_server
+
+and set EMBEDDING_SERVER_SOCKET for the workers. Both sides must share
+EMBEDDING_SERVER_AUTHKEY: messages are pickles, so only authenticated
+peers are read, and the socket is created owner/group-only.
+"""
+import os
+import queue
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+from app.config.settings import settings
+
+
+class _Request:
+    def __init__(self, texts):
+        self.texts = texts
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class EmbeddingServer:
+    """Accepts embedding requests and runs them through the model in batches"""
+
+    def __init__(self, model, socket_path: str, authkey: str, max_batch: int = 64, max_wait_ms: int = 5):
+        if not authkey:
+            raise ValueError("❌ EMBEDDING_SERVER_AUTHKEY must be set to run the embedding server")
+        self.model = model
+        self.socket_path = socket_path
+        self.authkey = authkey.encode("utf-8")
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._pending = queue.Queue()
+        self.stats = {"requests": 0, "batches": 0, "texts": 0}
+
+    def _collect_batch(self):
+        batch = [self._pending.get()]
+        size = len(batch[0].texts)
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._pending.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request.texts)
+        return batch
+
+    def _batch_loop(self):
+        while True:
+            batch = self._collect_batch()
+            texts = [text for request in batch for text in request.texts]
+            try:
+                vectors = self.model.embed_documents(texts)
+            except Exception as e:
+                for request in batch:
+                    request.error = str(e)
+                    request.done.set()
+                continue
+
+            self.stats["batches"] += 1
+            self.stats["texts"] += len(texts)
+            start = 0
+            for request in batch:
+                end = start + len(request.texts)
+                request.result = vectors[start:end]
+                request.done.set()
+                start = end
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    return
+
+                if message.get("op") == "stats":
+                    conn.send({"ok": True, "stats": dict(self.stats)})
+                    continue
+
+                request = _Request(message["texts"])
+                self.stats["requests"] += 1
+                self._pending.put(request)
+                request.done.wait()
+                if request.error:
+                    conn.send({"ok": False, "error": request.error})
+                else:
+                    conn.send({"ok": True, "vectors": request.result})
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        threading.Thread(target=self._batch_loop, name="embed-batcher", daemon=True).start()
+
+        # Restrict the socket from the moment it is bound, not after
+        previous_umask = os.umask(0o117)
+        try:
+            listener = Listener(self.socket_path, family="AF_UNIX", authkey=self.authkey)
+        finally:
+            os.umask(previous_umask)
+
+        with listener:
+            print(f"✅ Embedding server listening on {self.socket_path}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except (AuthenticationError, OSError, EOFError) as e:
+                    print(f"❌ Rejected embedding client: {e}")
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+
+class EmbeddingClient:
+    """Thin client with the same embed_query/embed_documents interface as the model"""
+
+    def __init__(self, socket_path: str, authkey: str):
+        self.socket_path = socket_path
+        self.authkey = authkey.encode("utf-8")
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = Client(self.socket_path, family="AF_UNIX", authkey=self.authkey)
+            self._local.conn = conn
+        return conn
+
+    def _call(self, message: dict) -> dict:
+        # Retry once on a fresh connection (e.g. after a server restart)
+        for attempt in range(2):
+            try:
+                conn = self._connection()
+                conn.send(message)
+                response = conn.recv()
+                break
+            except (EOFError, OSError, AuthenticationError) as e:
+                self._local.conn = None
+                if attempt:
+                    raise ConnectionError(f"Embedding server unreachable at {self.socket_path}: {e}")
+
+        if not response["ok"]:
+            raise RuntimeError(f"Embedding server error: {response['error']}")
+        return response
+
+    def embed_documents(self, texts: list[str]):
+        if not texts:
+            return []
+        return self._call({"op": "embed", "texts": list(texts)})["vectors"]
+
+    def embed_query(self, text: str):
+        return self.embed_documents([text])[0]
+
+    def stats(self) -> dict:
+        return self._call({"op": "stats"})["stats"]
+
+
+def serve():
+    from services.embeddings import load_local_model
+
+    server = EmbeddingServer(
+        load_local_model(),
+        settings.embedding_server_socket or "/tmp/rag-embeddings.sock",
+        settings.embedding_server_authkey,
+        max_batch=settings.embedding_server_max_batch,
+        max_wait_ms=settings.embedding_server_max_wait_ms,
+    )
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    serve()
@@ -1,12 +1,39 @@
 # services/embeddings.py
-from langchain_community.embeddings import HuggingFaceEmbeddings
+from app.config.settings import settings
+from app.lazy import Lazy
+from services.singleflight import SingleFlight
 
-embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+
+def load_local_model():
+    from services.embedding_backends import create_embedding_backend
+    return create_embedding_backend(settings)
+
+def _load_embeddings():
+    # With a shared embedding server configured, this worker never loads the model
+    if settings.embedding_server_socket:
+        from services.embedding_server import EmbeddingClient
+        return EmbeddingClient(settings.embedding_server_socket, settings.embedding_server_authkey)
+    return load_local_model()
+
+embeddings = Lazy("embeddings", _load_embeddings)
+query_flight = SingleFlight("embedding_query")
+
+def get_embeddings():
+    """Return the shared embedding model (or embedding server client), loading it on first use."""
+    return embeddings.get()
+
+def warmup_embeddings():
+    """Load the model and run one dummy embedding so the first request is fast."""
+    return len(get_embeddings().embed_query("warmup"))
 
 def generate_embedding_query(query: str):
-    """Embed a user query."""
-    return embeddings.embed_query(query)
+    """Embed a user query (identical concurrent queries are embedded once)."""
+    return query_flight.do(query, lambda: get_embeddings().embed_query(query))
 
 def generate_embedding_docs(docs: list[str]):
     """Embed multiple document chunks."""
-    return embeddings.embed_documents(docs)
+    return get_embeddings().embed_documents(docs)
+
+def generate_embedding_queries(queries: list[str]):
+    """Embed many queries in one batched call (the model is symmetric)."""
+    return get_embeddings().embed_documents(queries)
@@ -0,0 +1,223 @@
+# services/guest_reaper.py
+"""
+Garbage collection of abandoned guest tenants.
+
+A guest is inactive when its user record's last_active_at (or created_at
+for records written before activity tracking) is older than
+guest_ttl_hours. Reaping a guest removes, in this order:
+
+    vectors       the whole namespace in the vector index
+    chunk store   the namespace's local chunk texts
+    uploads       files saved under upload_dir/<user>
+    Redis         chat:<user>:*, bm25:, nsver: and active: keys
+    MongoDB       documents, chats and finally the user record
+
+The user record goes last, so a run that dies half-way is picked up again
+by the next one. Guests with a queued or running ingestion job are
+skipped (the job would recreate the namespace).
+
+Run summaries are kept in Redis, so the API can report on a reaper that
+runs as its own process:
+
+    reaper:totals     hash of totals across runs (dry runs only count in runs)
+    reaper:last_run   JSON summary of the most recent run
+
+From the backend directory:
+
+    PYTHONPATH=.:app python -m services.guest_reaper --dry-run
+    PYTHONPATH=.:app python -m services.guest_reaper --loop
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timedelta
+from app.config.settings import settings
+from app.database.mongodb import connection
+from app.database.pinecone import get_index
+from app.database.redis import run_pipeline
+from app.database.models.models import activity_key, chat_key
+from services.chunk_store import drop_chunk_store
+from services.ingestion_jobs import has_pending_jobs
+from services.search import bm25_key
+
+DELETE_BATCH = 500
+
+
+TOTALS_KEY = "reaper:totals"
+LAST_RUN_KEY = "reaper:last_run"
+METRIC_FIELDS = ("guests_scanned", "guests_reaped", "guests_skipped", "vectors_deleted",
+                 "documents_deleted", "chats_deleted", "redis_keys_deleted", "errors")
+
+
+def record_run(run: dict):
+    """Add a run to the totals in Redis and keep it as the last run"""
+    def build(pipe):
+        pipe.hincrby(TOTALS_KEY, "runs", 1)
+        if not run["dry_run"]:
+            for field in METRIC_FIELDS:
+                pipe.hincrby(TOTALS_KEY, field, run[field])
+        pipe.set(LAST_RUN_KEY, json.dumps(run))
+
+    run_pipeline(build)
+
+def reaper_stats() -> dict:
+    """Totals across runs plus a summary of the last run, from any process"""
+    totals, last_run = run_pipeline(lambda pipe: (pipe.hgetall(TOTALS_KEY), pipe.get(LAST_RUN_KEY)))
+    return {
+        "runs": int(totals.get("runs", 0)),
+        "totals": {field: int(totals.get(field, 0)) for field in METRIC_FIELDS},
+        "last_run": json.loads(last_run) if last_run else None,
+    }
+
+
+def _cutoff(ttl_hours: int = None) -> datetime:
+    return datetime.utcnow() - timedelta(hours=ttl_hours or settings.guest_ttl_hours)
+
+def _inactive_query(cutoff: datetime) -> dict:
+    return {
+        "isGuest": True,
+        "$or": [
+            {"last_active_at": {"$lt": cutoff}},
+            {"last_active_at": {"$exists": False}, "created_at": {"$lt": cutoff}},
+        ],
+    }
+
+def find_inactive_guests(cutoff: datetime, limit: int, after: str = None) -> list:
+    """User ids of inactive guests, in user_id order (pass the last id as `after` to page)"""
+    query = _inactive_query(cutoff)
+    if after:
+        query["user_id"] = {"$gt": after}
+    cursor = connection().users.find(query, {"user_id": 1, "_id": 0}).sort("user_id", 1).limit(limit)
+    return [user["user_id"] for user in cursor]
+
+
+def _guest_redis_keys(user_id: str, chat_ids: list) -> list:
+    """The guest's existing Redis keys, built from its chat ids (no keyspace scan)"""
+    keys = [chat_key(user_id, chat_id) for chat_id in chat_ids]
+    keys += [bm25_key(user_id), f"nsver:{user_id}", activity_key(user_id)]
+    exists = run_pipeline(lambda pipe: [pipe.exists(key) for key in keys])
+    return [key for key, found in zip(keys, exists) if found]
+
+def _delete_namespace(user_id: str):
+    try:
+        get_index().delete(delete_all=True, namespace=user_id)
+    except Exception as e:
+        # Pinecone answers 404 for a namespace that never had vectors
+        if getattr(e, "status", None) != 404:
+            raise
+
+def reap_guest(user_id: str, cutoff: datetime, dry_run: bool = False) -> dict:
+    """Remove one inactive guest from every store (or only count what would go)"""
+    db = connection()
+    documents = list(db.documents.find({"user_id": user_id}, {"chunk_ids": 1, "chunks_count": 1, "_id": 0}))
+    chat_ids = [chat["chat_id"] for chat in db.chats.find({"user_id": user_id}, {"chat_id": 1, "_id": 0})]
+    redis_keys = _guest_redis_keys(user_id, chat_ids)
+    report = {
+        "user_id": user_id,
+        "vectors": sum(len(doc.get("chunk_ids") or []) or doc.get("chunks_count", 0) for doc in documents),
+        "documents": len(documents),
+        "chats": len(chat_ids),
+        "redis_keys": len(redis_keys),
+    }
+    if dry_run:
+        return report
+
+    # Re-check right before deleting: the guest may have come back since the scan
+    if not db.users.find_one({"user_id": user_id, **_inactive_query(cutoff)}, {"_id": 1}):
+        return {**report, "skipped": "active again"}
+
+    _delete_namespace(user_id)
+    drop_chunk_store(user_id)
+    shutil.rmtree(os.path.join(settings.upload_dir, user_id), ignore_errors=True)
+
+    if redis_keys:
+        run_pipeline(lambda pipe: [pipe.unlink(*redis_keys[i:i + DELETE_BATCH])
+                                   for i in range(0, len(redis_keys), DELETE_BATCH)])
+
+    db.documents.delete_many({"user_id": user_id})
+    db.chats.delete_many({"user_id": user_id})
+    db.users.delete_one({"user_id": user_id, "isGuest": True})
+    return report
+
+
+def reap_inactive_guests(ttl_hours: int = None, batch_size: int = None, batch_pause: float = None,
+                         max_guests: int = None, dry_run: bool = False) -> dict:
+    """Reap inactive guests in throttled batches and return a run summary"""
+    cutoff = _cutoff(ttl_hours)
+    batch_size = batch_size or settings.guest_reaper_batch_size
+    batch_pause = settings.guest_reaper_batch_pause if batch_pause is None else batch_pause
+
+    run = {field: 0 for field in METRIC_FIELDS}
+    run.update({"dry_run": dry_run, "cutoff": cutoff.isoformat(), "started_at": datetime.utcnow().isoformat()})
+    started = time.perf_counter()
+    last_user_id = None
+
+    while max_guests is None or run["guests_scanned"] < max_guests:
+        limit = batch_size if max_guests is None else min(batch_size, max_guests - run["guests_scanned"])
+        guests = find_inactive_guests(cutoff, limit, after=last_user_id)
+        if not guests:
+            break
+        last_user_id = guests[-1]
+
+        for user_id in guests:
+            run["guests_scanned"] += 1
+            try:
+                if has_pending_jobs(user_id):
+                    run["guests_skipped"] += 1
+                    continue
+                report = reap_guest(user_id, cutoff, dry_run=dry_run)
+            except Exception as e:
+                print(f"❌ Guest reap failed for {user_id}: {e}")
+                run["errors"] += 1
+                continue
+            if report.get("skipped"):
+                run["guests_skipped"] += 1
+                continue
+            run["guests_reaped"] += 1
+            run["vectors_deleted"] += report["vectors"]
+            run["documents_deleted"] += report["documents"]
+            run["chats_deleted"] += report["chats"]
+            run["redis_keys_deleted"] += report["redis_keys"]
+
+        if len(guests) < limit:
+            break
+        time.sleep(batch_pause)
+
+    run["duration_s"] = round(time.perf_counter() - started, 3)
+    try:
+        record_run(run)
+    except Exception as e:
+        print(f"❌ Reaper metrics error: {e}")
+    verb = "Would reap" if dry_run else "Reaped"
+    print(f"✅ {verb} {run['guests_reaped']} inactive guests ({run['vectors_deleted']} vectors, "
+          f"{run['documents_deleted']} documents, {run['chats_deleted']} chats, {run['redis_keys_deleted']} Redis keys)")
+    return run
+
+def reaper_loop(interval: int = None, **kwargs):
+    while True:
+        try:
+            reap_inactive_guests(**kwargs)
+        except Exception as e:
+            print(f"❌ Guest reaper error: {e}")
+        time.sleep(interval or settings.guest_reaper_interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove inactive guest tenants from every store")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be removed")
+    parser.add_argument("--ttl-hours", type=int, default=settings.guest_ttl_hours)
+    parser.add_argument("--batch-size", type=int, default=settings.guest_reaper_batch_size)
+    parser.add_argument("--batch-pause", type=float, default=settings.guest_reaper_batch_pause)
+    parser.add_argument("--max-guests", type=int, default=None)
+    parser.add_argument("--loop", action="store_true", help="run every --interval seconds")
+    parser.add_argument("--interval", type=int, default=settings.guest_reaper_interval)
+    args = parser.parse_args()
+
+    options = dict(ttl_hours=args.ttl_hours, batch_size=args.batch_size, batch_pause=args.batch_pause,
+                   max_guests=args.max_guests, dry_run=args.dry_run)
+    if args.loop:
+        reaper_loop(args.interval, **options)
+    else:
+        reap_inactive_guests(**options)
@@ -0,0 +1,308 @@
+# services/ingestion_jobs.py
+"""
+Background ingestion: API workers enqueue uploads, a pool of worker
+processes runs the load -> split -> embed -> upsert pipeline.
+
+Redis layout:
+    ingest:queue:<user>     list of the tenant's pending job ids
+    ingest:tenants          ring of tenants with pending jobs; workers take
+                            the first tenant under its concurrency limit and
+                            move it to the back, so one tenant's backlog
+                            cannot starve the others
+    ingest:processing       job ids currently claimed by a worker
+    ingest:wakeup           wakes idle workers when a job or a slot frees up
+    ingest:job:<id>         hash with status, progress counters and result
+    ingest:active:<user>    zset of the tenant's running job ids -> slot deadline
+                            (concurrency limit; expired slots are pruned on acquire)
+    ingest:pending:<user>   zset of the tenant's queued or running job ids -> enqueue
+                            time (lets the guest reaper skip tenants with work in flight)
+
+Jobs whose worker died (crash, deploy) stop heartbeating; one of the
+workers returns them to their tenant's queue every
+ingest_requeue_interval seconds.
+
+Start the workers from the backend directory with
+
+    PYTHONPATH=.:app python -m services.ingestion_jobs --workers 4
+"""
+import argparse
+import json
+import multiprocessing
+import threading
+import time
+import uuid
+from datetime import datetime
+from app.config.settings import settings
+from app.database.redis import get_redis, run_pipeline
+
+LEGACY_QUEUE_KEY = "ingest:queue"  # single global queue used before per-tenant queues
+TENANTS_KEY = "ingest:tenants"
+PROCESSING_KEY = "ingest:processing"
+WAKEUP_KEY = "ingest:wakeup"
+REQUEUE_KEY = "ingest:requeue"
+PROGRESS_FIELDS = ("pages_parsed", "chunks_total", "chunks_embedded", "vectors_upserted")
+
+
+def _job_key(job_id: str) -> str:
+    return f"ingest:job:{job_id}"
+
+def _queue_key(user_id: str) -> str:
+    return f"ingest:queue:{user_id}"
+
+def _active_key(user_id: str) -> str:
+    return f"ingest:active:{user_id}"
+
+def _pending_key(user_id: str) -> str:
+    return f"ingest:pending:{user_id}"
+
+def _now() -> str:
+    return datetime.utcnow().isoformat()
+
+def _update_job(job_id: str, **fields):
+    get_redis().hset(_job_key(job_id), mapping={**fields, "updated_at": _now(), "heartbeat": time.time()})
+
+
+def enqueue_ingestion(user_id: str, file_path: str, doc_id: str = None) -> str:
+    """Queue a file for ingestion and return the job id to poll"""
+    job_id = f"job_{uuid.uuid4().hex[:16]}"
+    job = {
+        "job_id": job_id,
+        "user_id": user_id,
+        "file_path": file_path,
+        "doc_id": doc_id or "",
+        "status": "queued",
+        "attempts": 0,
+        "error": "",
+        "result": "",
+        "created_at": _now(),
+        "updated_at": _now(),
+        "heartbeat": time.time(),
+        **{field: 0 for field in PROGRESS_FIELDS},
+    }
+    def build(pipe):
+        pipe.hset(_job_key(job_id), mapping=job)
+        pipe.expire(_job_key(job_id), settings.ingest_job_ttl)
+        pipe.zadd(_pending_key(user_id), {job_id: time.time()})
+        pipe.expire(_pending_key(user_id), settings.ingest_job_ttl)
+
+    run_pipeline(build)
+    _push_job(user_id, job_id)
+    return job_id
+
+def has_pending_jobs(user_id: str) -> bool:
+    """True if the tenant has a queued or running job (entries older than a job record are dropped)"""
+    now = time.time()
+    def build(pipe):
+        pipe.zremrangebyscore(_pending_key(user_id), "-inf", now - settings.ingest_job_ttl)
+        pipe.zcard(_pending_key(user_id))
+        pipe.zcount(_active_key(user_id), now, "+inf")
+
+    _, pending, running = run_pipeline(build)
+    return pending + running > 0
+
+def get_job(job_id: str):
+    """Get a job's status and progress, or None if unknown/expired"""
+    job = get_redis().hgetall(_job_key(job_id))
+    if not job:
+        return None
+    for field in PROGRESS_FIELDS + ("attempts",):
+        job[field] = int(job.get(field) or 0)
+    job.pop("heartbeat", None)
+    job["result"] = json.loads(job["result"]) if job.get("result") else None
+    return job
+
+
+# Queue a job for its tenant; a tenant whose queue was empty joins the ring
+_PUSH_JOB = """
+redis.call(ARGV[3] == 'front' and 'LPUSH' or 'RPUSH', KEYS[1], ARGV[1])
+if redis.call('LLEN', KEYS[1]) == 1 then
+    redis.call('RPUSH', KEYS[2], ARGV[2])
+end
+redis.call('LPUSH', KEYS[3], 1)
+redis.call('LTRIM', KEYS[3], 0, 255)
+"""
+
+# Walk the tenant ring once: the first tenant under its limit gets a slot
+# and its oldest job is claimed. Tenants go to the back of the ring, and
+# leave it when their queue is empty. Queue and slot keys are built from
+# the prefixes in ARGV[5] / ARGV[6].
+_CLAIM_JOB = """
+for _ = 1, redis.call('LLEN', KEYS[1]) do
+    local tenant = redis.call('LPOP', KEYS[1])
+    if not tenant then
+        return false
+    end
+    local queue = ARGV[5] .. tenant
+    local active = ARGV[6] .. tenant
+    if redis.call('LLEN', queue) > 0 then
+        if redis.call('TYPE', active).ok == 'string' then
+            redis.call('DEL', active)  -- counter left by the first slot scheme
+        end
+        redis.call('ZREMRANGEBYSCORE', active, '-inf', ARGV[1])
+        if redis.call('ZCARD', active) < tonumber(ARGV[3]) then
+            local job_id = redis.call('LPOP', queue)
+            redis.call('ZADD', active, ARGV[2], job_id)
+            redis.call('EXPIRE', active, ARGV[4])
+            redis.call('RPUSH', KEYS[2], job_id)
+            if redis.call('LLEN', queue) > 0 then
+                redis.call('RPUSH', KEYS[1], tenant)
+            end
+            return {tenant, job_id}
+        end
+        redis.call('RPUSH', KEYS[1], tenant)
+    end
+end
+return false
+"""
+
+def _push_job(user_id: str, job_id: str, front: bool = False):
+    push = get_redis().register_script(_PUSH_JOB)
+    push(keys=[_queue_key(user_id), TENANTS_KEY, WAKEUP_KEY], args=[job_id, user_id, "front" if front else "back"])
+
+def _claim_job():
+    """(user_id, job_id) of the next job a worker may run, or None"""
+    now = time.time()
+    claim = get_redis().register_script(_CLAIM_JOB)
+    claimed = claim(
+        keys=[TENANTS_KEY, PROCESSING_KEY],
+        args=[now, now + settings.ingest_job_timeout, settings.ingest_max_jobs_per_user,
+              settings.ingest_job_timeout, _queue_key(""), _active_key("")],
+    )
+    return tuple(claimed) if claimed else None
+
+def _renew_tenant_slot(user_id: str, job_id: str):
+    """Push the slot's deadline out while the job is still running"""
+    def build(pipe):
+        pipe.zadd(_active_key(user_id), {job_id: time.time() + settings.ingest_job_timeout}, xx=True)
+        pipe.expire(_active_key(user_id), settings.ingest_job_timeout)
+
+    run_pipeline(build)
+
+def _release_tenant_slot(user_id: str, job_id: str):
+    def build(pipe):
+        pipe.zrem(_active_key(user_id), job_id)
+        pipe.lpush(WAKEUP_KEY, 1)  # the tenant's next job may run now
+        pipe.ltrim(WAKEUP_KEY, 0, 255)
+
+    run_pipeline(build)
+
+
+def run_job(job_id: str):
+    from services.DocsLoader import store_docs_in_pinecone
+
+    job = get_job(job_id)
+    if job is None:
+        return
+    attempts = job["attempts"] + 1
+    _update_job(job_id, status="running", attempts=attempts, started_at=_now())
+
+    try:
+        result = store_docs_in_pinecone(
+            job["user_id"],
+            job["file_path"],
+            doc_id=job["doc_id"] or None,
+            progress=lambda **counts: _update_job(job_id, **counts),
+        )
+    except Exception as e:
+        result = {"error": f"❌ Ingestion failed: {e}"}
+
+    if "error" in result:
+        _update_job(job_id, status="failed", error=result["error"], finished_at=_now())
+    else:
+        _update_job(job_id, status="completed", result=json.dumps(result), finished_at=_now())
+
+def _heartbeat(job_id: str, user_id: str, stop: threading.Event):
+    """Keep the job and its tenant slot alive, also during long single steps"""
+    interval = max(1, settings.ingest_job_timeout / 3)
+    while not stop.wait(interval):
+        try:
+            get_redis().hset(_job_key(job_id), "heartbeat", time.time())
+            _renew_tenant_slot(user_id, job_id)
+        except Exception as e:
+            print(f"❌ Ingestion heartbeat error: {e}")
+
+def process_next_job(timeout: int = 5) -> bool:
+    """Claim and run one job. Returns False if no tenant had a job it may run."""
+    redis_client = get_redis()
+    claimed = _claim_job()
+    if claimed is None:
+        redis_client.blpop(WAKEUP_KEY, timeout)
+        return False
+    user_id, job_id = claimed
+
+    stop = threading.Event()
+    try:
+        if not redis_client.exists(_job_key(job_id)):
+            return True  # job record expired while queued
+        threading.Thread(target=_heartbeat, args=(job_id, user_id, stop), daemon=True).start()
+        run_job(job_id)
+    finally:
+        stop.set()
+        _release_tenant_slot(user_id, job_id)
+        def build(pipe):
+            pipe.zrem(_pending_key(user_id), job_id)
+            pipe.lrem(PROCESSING_KEY, 1, job_id)
+
+        run_pipeline(build)
+    return True
+
+def requeue_stale_jobs():
+    """Return jobs whose worker stopped heartbeating to the front of their tenant's queue"""
+    redis_client = get_redis()
+    cutoff = time.time() - settings.ingest_job_timeout
+    requeued = 0
+    for job_id in redis_client.lrange(PROCESSING_KEY, 0, -1):
+        heartbeat, user_id = redis_client.hmget(_job_key(job_id), "heartbeat", "user_id")
+        if heartbeat is None or not user_id:
+            redis_client.lrem(PROCESSING_KEY, 1, job_id)
+        elif float(heartbeat) < cutoff and redis_client.lrem(PROCESSING_KEY, 1, job_id):
+            _update_job(job_id, status="queued")
+            _release_tenant_slot(user_id, job_id)
+            _push_job(user_id, job_id, front=True)
+            requeued += 1
+    return requeued
+
+def _migrate_legacy_queue():
+    """Move jobs left in the single global queue to their tenants' queues"""
+    redis_client = get_redis()
+    while (job_id := redis_client.lpop(LEGACY_QUEUE_KEY)) is not None:
+        user_id = redis_client.hget(_job_key(job_id), "user_id")
+        if user_id:
+            _push_job(user_id, job_id)
+
+def _maybe_requeue_stale_jobs():
+    """Run requeue_stale_jobs at most once per ingest_requeue_interval across all workers"""
+    if get_redis().set(REQUEUE_KEY, 1, nx=True, ex=settings.ingest_requeue_interval):
+        requeued = requeue_stale_jobs()
+        if requeued:
+            print(f"✅ Requeued {requeued} stale ingestion jobs")
+
+
+def worker_loop():
+    print("✅ Ingestion worker started")
+    while True:
+        try:
+            _maybe_requeue_stale_jobs()
+            process_next_job()
+        except Exception as e:
+            print(f"❌ Ingestion worker error: {e}")
+            time.sleep(1)
+
+def run_workers(workers: int):
+    """Start a pool of worker processes (each loads its own clients lazily)"""
+    _migrate_legacy_queue()
+    processes = [
+        multiprocessing.Process(target=worker_loop, name=f"ingest-worker-{i}", daemon=True)
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run background ingestion workers")
+    parser.add_argument("--workers", type=int, default=settings.ingest_workers)
+    args = parser.parse_args()
+    run_workers(args.workers)
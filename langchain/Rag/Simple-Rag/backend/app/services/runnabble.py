@@ -1,22 +1,55 @@
-from dotenv import load_dotenv
 from langchain_core.output_parsers import StrOutputParser
-from langchain_groq import ChatGroq
 from langchain.schema.runnable import RunnableSequence, RunnableParallel, RunnableLambda
-from services.search import hybrid_search
+from services.search import hybrid_search, fetch_query_state, afetch_query_state
 from services.prompts import prompt_enhancer, generation_prompt
-from app.models import get_chat_context, update_chat_context, update_user_tokens, update_chat_tokens
+from services.embeddings import generate_embedding_queries
+from services.singleflight import SingleFlight, normalize_prompt
+from services.session_cache import session_cache
+from app.database.models.models import save_chat_messages, asave_chat_messages, update_user_tokens, update_chat_tokens, bulk_update_tokens
 from app.config.settings import settings
+from app.lazy import Lazy
+import asyncio
+import hashlib
 import tiktoken
 
-load_dotenv()
 
-llm = ChatGroq(
-    model="llama-3.3-70b-versatile", 
-    temperature=0.7,
-    groq_api_key=settings.groq_api_key
-)
+def _create_llm(rate_limiter=None):
+    from dotenv import load_dotenv
+    from langchain_groq import ChatGroq
+
+    load_dotenv()
+    return ChatGroq(
+        model="llama-3.3-70b-versatile", 
+        temperature=0.7,
+        groq_api_key=settings.groq_api_key,
+        rate_limiter=rate_limiter
+    )
+
+def _create_batch_llm():
+    from langchain_core.rate_limiters import InMemoryRateLimiter
+
+    return _create_llm(rate_limiter=InMemoryRateLimiter(
+        requests_per_second=settings.batch_requests_per_second,
+        max_bucket_size=settings.batch_max_concurrency
+    ))
+
+llm_client = Lazy("llm", _create_llm)
+batch_llm_client = Lazy("batch_llm", _create_batch_llm, required=False)
 parser = StrOutputParser()
 
+# Concurrent identical requests share one in-flight computation per stage
+enhance_flight = SingleFlight("enhance")
+retrieve_flight = SingleFlight("retrieve")
+generate_flight = SingleFlight("generate")
+
+def get_llm():
+    """Return the shared chat model (created on first use)"""
+    return llm_client.get()
+
+def get_batch_llm():
+    """Chat model for bulk workloads, rate limited to batch_requests_per_second"""
+    return batch_llm_client.get()
+
 # Token counter
 def count_tokens(text: str) -> int:
     """Count tokens in text"""
@@ -31,19 +64,27 @@ def create_rag_pipeline():
     
     def enhance_prompt(data):
         prompt = data["prompt"]
-        enhanced = prompt_enhancer() | llm | parser
-        return enhanced.invoke({"prompt": prompt})
+        enhanced = prompt_enhancer() | get_llm() | parser
+        return enhance_flight.do(
+            normalize_prompt(prompt),
+            lambda: enhanced.invoke({"prompt": prompt})
+        )
     
     def get_context(data):
         user_id = data["user_id"]
         chat_id = data["chat_id"]
         enhanced_prompt = data["enhanced_prompt"]
         
-        # Get chat history from Redis
-        chat_context = get_chat_context(user_id, chat_id)
+        # Get chat history and BM25 encoder from Redis (one round trip)
+        state = fetch_query_state(user_id, chat_id)
+        chat_context = state["chat_context"]
         
         # Get documents via hybrid search
-        documents = hybrid_search(user_id, enhanced_prompt)
+        namespace = (user_id, state["namespace_version"])
+        documents = retrieve_flight.do(
+            (namespace, normalize_prompt(enhanced_prompt)),
+            lambda: hybrid_search(user_id, enhanced_prompt, bm25=state["bm25"])
+        )
         doc_context = "\n".join(documents)
         
         # Combine contexts
@@ -52,19 +93,24 @@ def create_rag_pipeline():
         return {
             "enhanced_prompt": enhanced_prompt,
             "context": full_context,
+            "namespace": namespace,
             "user_id": user_id,
             "chat_id": chat_id
         }
     
     def generate_answer(data):
         # Generate answer
-        generation_chain = generation_prompt() | llm | parser
-        answer = generation_chain.invoke({
-            "context": data["context"],
-            "enhanced_prompt": data["enhanced_prompt"]
-        })
+        generation_chain = generation_prompt() | get_llm() | parser
+        context_hash = hashlib.sha256(data["context"].encode("utf-8")).hexdigest()
+        answer = generate_flight.do(
+            (data["namespace"], normalize_prompt(data["enhanced_prompt"]), context_hash),
+            lambda: generation_chain.invoke({
+                "context": data["context"],
+                "enhanced_prompt": data["enhanced_prompt"]
+            })
+        )
         
-        # Count tokens
+        # Count tokens (charged to every caller, including coalesced ones)
         prompt_tokens = count_tokens(data["enhanced_prompt"] + data["context"])
         answer_tokens = count_tokens(answer)
         total_tokens = prompt_tokens + answer_tokens
@@ -74,8 +120,11 @@ def create_rag_pipeline():
         update_chat_tokens(data["user_id"], data["chat_id"], total_tokens)
         
         # Save to chat history
-        update_chat_context(data["user_id"], data["chat_id"], "user", data["enhanced_prompt"])
-        update_chat_context(data["user_id"], data["chat_id"], "assistant", answer)
+        save_chat_messages(data["user_id"], data["chat_id"], [
+            ("user", data["enhanced_prompt"]),
+            ("assistant", answer)
+        ])
+        session_cache.invalidate(data["user_id"], data["chat_id"])
         
         return {
             "answer": answer,
@@ -84,11 +133,10 @@ def create_rag_pipeline():
     
     # Creatingggggggg pipeline
     pipeline = (
-        RunnableLambda(enhance_prompt) |
-        RunnableLambda(lambda enhanced: {
-            "enhanced_prompt": enhanced,
-            "user_id": None,  
-            "chat_id": None   #
+        RunnableLambda(lambda data: {
+            "enhanced_prompt": enhance_prompt(data),
+            "user_id": data["user_id"],
+            "chat_id": data["chat_id"]
         }) |
         RunnableLambda(get_context) |
         RunnableLambda(generate_answer)
@@ -121,4 +169,135 @@ def query_rag_system(user_id: str, chat_id: str, prompt: str):
             "success": False,
             "error": f"❌ RAG error: {str(e)}",
             "answer": "Sorry, I couldn't process your request."
-        }
\ No newline at end of file
+        }
+
+
+async def abatch_query_rag_system(items: list, max_concurrency: int = None, save_history: bool = True,
+                                  user_budgets: dict = None, chat_budgets: dict = None):
+    """Answer many (user_id, chat_id, prompt) items; yields results as they complete.
+
+    Prompts are enhanced with one rate-limited LLM batch, all enhanced
+    queries are embedded in one call, retrievals run concurrently and
+    answers stream back as generation finishes. Token usage is written
+    once, in bulk, at the end. Every failure (including a failed
+    embedding call) is reported on the items it affects.
+
+    user_budgets {user_id: tokens} and chat_budgets {(user_id, chat_id):
+    tokens} cap what the batch may spend; missing keys are unlimited.
+    Items are refused once their user's or chat's budget runs out.
+    """
+    # The operator's limit is a ceiling, callers may only go lower
+    max_concurrency = min(max_concurrency or settings.batch_max_concurrency, settings.batch_max_concurrency)
+    config = {"max_concurrency": max_concurrency}
+    llm = get_batch_llm()
+    user_budgets = dict(user_budgets or {})
+    chat_budgets = dict(chat_budgets or {})
+    user_tokens, chat_tokens = {}, {}
+    
+    def failure(i, error):
+        return {
+            "index": i,
+            "success": False,
+            "error": f"❌ RAG error: {str(error)}",
+            "answer": "Sorry, I couldn't process your request."
+        }
+    
+    def over_budget(i, needed: float = 1):
+        item = items[i]
+        user_left = user_budgets.get(item["user_id"], float("inf"))
+        chat_left = chat_budgets.get((item["user_id"], item["chat_id"]), float("inf"))
+        return min(user_left, chat_left) < needed
+    
+    def charge(item, tokens: int):
+        for budgets, key in ((user_budgets, item["user_id"]), (chat_budgets, (item["user_id"], item["chat_id"]))):
+            if key in budgets:
+                budgets[key] -= tokens
+        user_tokens[item["user_id"]] = user_tokens.get(item["user_id"], 0) + tokens
+        chat_key = (item["user_id"], item["chat_id"])
+        chat_tokens[chat_key] = chat_tokens.get(chat_key, 0) + tokens
+    
+    limit_error = "Token limit exceeded"
+    runnable = [i for i in range(len(items)) if not over_budget(i)]
+    for i in range(len(items)):
+        if over_budget(i):
+            yield failure(i, limit_error)
+    
+    # 1. Enhance every prompt
+    enhancer = prompt_enhancer() | llm | parser
+    enhanced = dict(zip(runnable, await enhancer.abatch(
+        [{"prompt": items[i]["prompt"]} for i in runnable], config=config, return_exceptions=True
+    ) if runnable else []))
+    for i, e in enhanced.items():
+        if isinstance(e, Exception):
+            yield failure(i, e)
+    
+    # 2. Embed all enhanced queries in one batched call
+    ok = [i for i, e in enhanced.items() if not isinstance(e, Exception)]
+    try:
+        vectors = await asyncio.to_thread(generate_embedding_queries, [enhanced[i] for i in ok]) if ok else []
+    except Exception as e:
+        for i in ok:
+            yield failure(i, e)
+        return
+    dense = dict(zip(ok, vectors))
+    
+    # 3. Retrieve chat history + documents concurrently (bounded)
+    semaphore = asyncio.Semaphore(settings.batch_retrieval_concurrency)
+    
+    async def retrieve(i):
+        item = items[i]
+        async with semaphore:
+            state = await afetch_query_state(item["user_id"], item["chat_id"])
+            documents = await asyncio.to_thread(
+                hybrid_search, item["user_id"], enhanced[i], dense_vector=dense[i], bm25=state["bm25"]
+            )
+        return f"Chat History:\n{state['chat_context']}\n\nDocuments:\n" + "\n".join(documents)
+    
+    contexts = dict(zip(ok, await asyncio.gather(*(retrieve(i) for i in ok), return_exceptions=True)))
+    ready = [i for i in ok if not isinstance(contexts[i], Exception)]
+    for i in ok:
+        if isinstance(contexts[i], Exception):
+            yield failure(i, contexts[i])
+    
+    # 4. Generate answers; stream each one as soon as it completes. The
+    #    budget is checked when a generation starts, so at most
+    #    max_concurrency answers can be in flight past a limit.
+    generation_chain = generation_prompt() | llm | parser
+    generation_slots = asyncio.Semaphore(max_concurrency)
+    
+    async def generate(i):
+        item = items[i]
+        async with generation_slots:
+            prompt_tokens = int(count_tokens(enhanced[i] + contexts[i]))
+            if over_budget(i, prompt_tokens):
+                return failure(i, limit_error)
+            try:
+                answer = await generation_chain.ainvoke({"context": contexts[i], "enhanced_prompt": enhanced[i]})
+            except Exception as e:
+                return failure(i, e)
+            
+            total_tokens = prompt_tokens + int(count_tokens(answer))
+            charge(item, total_tokens)
+            if save_history:
+                await asave_chat_messages(item["user_id"], item["chat_id"], [
+                    ("user", enhanced[i]),
+                    ("assistant", answer)
+                ])
+            return {
+                "index": i,
+                "success": True,
+                "answer": answer,
+                "tokens_used": total_tokens
+            }
+    
+    tasks = [asyncio.create_task(generate(i)) for i in ready]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            yield await next_result
+    finally:
+        for task in tasks:
+            task.cancel()
+        # 5. One bulk usage write for the whole batch
+        await asyncio.to_thread(bulk_update_tokens, user_tokens, chat_tokens)
+        for user_id, chat_id in chat_tokens:
+            session_cache.invalidate(user_id, chat_id)
@@ -1,55 +1,188 @@
-from app.db.pinecone_db import get_pinecone
+from app.database.pinecone import get_index
+from app.database.redis import get_bytes, aget_bytes, set_bytes, get_redis, queue_get_bytes, run_pipeline, arun_pipeline, redis_lock
+from app.database.models.models import queue_chat_context, queue_chat_head, format_chat_context
 from services.embeddings import generate_embedding_query
+from services.chunk_store import get_chunk_store
+from services.session_cache import session_cache
+from services.singleflight import SingleFlight
 from pinecone_text.sparse import BM25Encoder
 import pickle
-import redis
 from app.config.settings import settings
 
-redis_client = redis.Redis.from_url(settings.redis_url)
+bm25_flight = SingleFlight("bm25_load")
+state_flight = SingleFlight("query_state")
+
+def bm25_key(user_id: str) -> str:
+    return f"bm25:{user_id}"
+
+def _unpickle_bm25(bm25_data):
+    try:
+        return pickle.loads(bm25_data) if bm25_data else None
+    except Exception as e:
+        print(f"❌ BM25 load error: {e}")
+        return None
+
+def load_user_bm25(user_id: str):
+    """Get the user's fitted BM25 encoder, or None if there isn't one"""
+    try:
+        return bm25_flight.do(user_id, lambda: _unpickle_bm25(get_bytes(bm25_key(user_id))))
+    except Exception as e:
+        print(f"❌ BM25 load error: {e}")
+        return None
+
+def load_user_bm25_for_update(user_id: str):
+    """Private copy of the user's encoder that the caller may modify.
+
+    load_user_bm25 shares one object between concurrent callers (and the
+    session cache), so it must never be changed in place.
+    """
+    return _unpickle_bm25(get_bytes(bm25_key(user_id)))
 
 def get_user_bm25(user_id: str):
     """Get or create BM25 encoder for user"""
+    bm25 = load_user_bm25(user_id)
+    if bm25 is None:
+        # Create new BM25 encoder
+        bm25 = BM25Encoder().default()
+    return bm25
+
+def _queue_query_state(pipe, user_id: str, chat_id: str, with_context: bool = True, with_bm25: bool = True):
+    # Head first: a message saved in between then reads as a change next time
+    queue_chat_head(pipe, user_id, chat_id)
+    if with_context:
+        queue_chat_context(pipe, user_id, chat_id)
+    pipe.get(f"nsver:{user_id}")
+    if with_bm25:
+        queue_get_bytes(pipe, bm25_key(user_id))
+
+def _cached_context(user_id: str, chat_id: str, cached, head):
+    """Cached chat context if no message was saved since it was read, else None"""
+    hit = cached is not None and cached[1] == head
+    session_cache.record("context", hit)
+    return cached[0] if hit else None
+
+def _cache_bm25(user_id: str, namespace_version: int, bm25_data):
+    """Unpickle the user's encoder and keep it in the session cache at this namespace version"""
+    bm25 = _unpickle_bm25(bm25_data) or BM25Encoder().default()
+    size = len(bm25_data) if bm25_data else 64 * len(bm25.doc_freq or ())
+    session_cache.put_bm25(user_id, namespace_version, bm25, size)
+    return bm25
+
+def _cached_bm25(user_id: str, cached, namespace_version: int):
+    hit = cached is not None and cached[0] == namespace_version
+    session_cache.record("bm25", hit)
+    return cached[1] if hit else None
+
+def prefetch_user_bm25(user_id: str):
+    """Load the user's encoder into the session cache unless it is already current"""
+    namespace_version, bm25_data = run_pipeline(
+        lambda pipe: (pipe.get(f"nsver:{user_id}"), queue_get_bytes(pipe, bm25_key(user_id)))
+    )
+    namespace_version = int(namespace_version or 0)
+    cached = session_cache.peek_bm25(user_id)
+    if cached is None or cached[0] != namespace_version:
+        _cache_bm25(user_id, namespace_version, bm25_data)
+
+def _empty_state() -> dict:
+    return {"chat_context": "", "bm25": BM25Encoder().default(), "namespace_version": 0}
+
+def fetch_query_state(user_id: str, chat_id: str) -> dict:
+    """Chat history, BM25 encoder and namespace version for a query, in one Redis round trip.
+
+    A cached encoder at the current namespace version skips the BM25
+    download and unpickling; cached chat context (prefetched by
+    services/session_warmup.py) is used while the history's newest entry
+    is unchanged.
+    """
+    def load():
+        cached = session_cache.peek_bm25(user_id)
+        cached_context = session_cache.peek_chat_context(user_id, chat_id)
+        results = run_pipeline(lambda pipe: _queue_query_state(
+            pipe, user_id, chat_id, with_context=cached_context is None, with_bm25=cached is None
+        ))
+        head = results.pop(0)
+        messages = results.pop(0) if cached_context is None else None
+        namespace_version, *bm25_data = results
+        chat_context = _cached_context(user_id, chat_id, cached_context, head)
+        if chat_context is None:
+            if messages is None:
+                messages = run_pipeline(lambda pipe: queue_chat_context(pipe, user_id, chat_id))[0]
+            chat_context = format_chat_context(messages)
+            session_cache.put_chat_context(user_id, chat_id, chat_context, head)
+        namespace_version = int(namespace_version or 0)
+        bm25 = _cached_bm25(user_id, cached, namespace_version)
+        if bm25 is None:
+            blob = bm25_data[0] if bm25_data else get_bytes(bm25_key(user_id))
+            bm25 = _cache_bm25(user_id, namespace_version, blob)
+        return {"chat_context": chat_context, "bm25": bm25, "namespace_version": namespace_version}
+
     try:
-        bm25_key = f"bm25:{user_id}"
-        bm25_data = redis_client.get(bm25_key)
-        
-        if bm25_data:
-            return pickle.loads(bm25_data)
-        else:
-            # Create new BM25 encoder
-            bm25 = BM25Encoder().default()
-            return bm25
-    except:
-        return BM25Encoder().default()
+        return state_flight.do((user_id, chat_id), load)
+    except Exception as e:
+        print(f"❌ Query state fetch error: {e}")
+        return _empty_state()
+
+async def afetch_query_state(user_id: str, chat_id: str) -> dict:
+    try:
+        cached = session_cache.peek_bm25(user_id)
+        cached_context = session_cache.peek_chat_context(user_id, chat_id)
+        results = await arun_pipeline(lambda pipe: _queue_query_state(
+            pipe, user_id, chat_id, with_context=cached_context is None, with_bm25=cached is None
+        ))
+        head = results.pop(0)
+        messages = results.pop(0) if cached_context is None else None
+        namespace_version, *bm25_data = results
+        chat_context = _cached_context(user_id, chat_id, cached_context, head)
+        if chat_context is None:
+            if messages is None:
+                messages = (await arun_pipeline(lambda pipe: queue_chat_context(pipe, user_id, chat_id)))[0]
+            chat_context = format_chat_context(messages)
+            session_cache.put_chat_context(user_id, chat_id, chat_context, head)
+        namespace_version = int(namespace_version or 0)
+        bm25 = _cached_bm25(user_id, cached, namespace_version)
+        if bm25 is None:
+            blob = bm25_data[0] if bm25_data else await aget_bytes(bm25_key(user_id))
+            bm25 = _cache_bm25(user_id, namespace_version, blob)
+        return {"chat_context": chat_context, "bm25": bm25, "namespace_version": namespace_version}
+    except Exception as e:
+        print(f"❌ Query state fetch error: {e}")
+        return _empty_state()
 
 def save_user_bm25(user_id: str, bm25_encoder):
-    """Save user's BM25 encoder to Redis"""
+    """Save user's BM25 encoder to Redis.
+
+    Kept without a TTL (like nsver:): an expired encoder would turn the
+    next incremental update into a full refit over the tenant's chunks.
+    Document deletes and the guest reaper remove it explicitly.
+    """
     try:
-        bm25_key = f"bm25:{user_id}"
-        bm25_data = pickle.dumps(bm25_encoder)
-        redis_client.setex(bm25_key, settings.redis_ttl, bm25_data)
+        set_bytes(bm25_key(user_id), pickle.dumps(bm25_encoder), persist=True)
     except Exception as e:
         print(f"❌ BM25 save error: {e}")
 
-def train_bm25_for_user(user_id: str, new_texts: list):
-    """Train BM25 encoder with user's documents"""
+def delete_user_bm25(user_id: str):
+    get_redis().delete(bm25_key(user_id))
+
+def train_bm25_for_user(user_id: str):
+    """Fit the user's BM25 encoder over every chunk currently in the namespace"""
     try:
-        bm25 = get_user_bm25(user_id)
+        bm25 = BM25Encoder()  # fresh: a full fit replaces every statistic anyway
         
-        # Get existing texts from Pinecone
-        pc = get_pinecone()
-        index = pc.Index(settings.pinecone_index_name)
+        # Get texts from the local chunk store
+        all_texts = list(get_chunk_store(user_id).iter_texts())
         
-        # Query all user documents
-        existing_results = index.query(
-            namespace=user_id,
-            vector=[0] * settings.embedding_dimension,
-            top_k=10000,
-            include_metadata=True
-        )
-        
-        existing_texts = [match.metadata["text"] for match in existing_results.matches]
-        all_texts = existing_texts + new_texts
+        if not all_texts:
+            # Older vectors still carry their text in Pinecone metadata
+            existing_results = get_index().query(
+                namespace=user_id,
+                vector=[0] * settings.embedding_dimension,
+                top_k=10000,
+                include_metadata=True
+            )
+            all_texts = [
+                match.metadata["text"] for match in existing_results.matches
+                if match.metadata and "text" in match.metadata
+            ]
         
         # Train BM25
         if all_texts:
@@ -59,18 +192,114 @@ def train_bm25_for_user(user_id: str, new_texts: list):
     except Exception as e:
         print(f"❌ BM25 training error: {e}")
 
-def hybrid_search(user_id: str, query: str, top_k: int = 5):
-    """Hybrid search with user isolation"""
+def _adjust_bm25_stats(bm25, texts: list, sign: int):
+    """Add (sign=1) or remove (sign=-1) documents from fitted BM25 statistics"""
+    total_length = bm25.avgdl * bm25.n_docs
+    for text in texts:
+        indices, tf = bm25._tf(text)
+        if not indices:
+            continue
+        bm25.n_docs += sign
+        total_length += sign * sum(tf)
+        for idx in indices:
+            count = bm25.doc_freq.get(idx, 0) + sign
+            if count > 0:
+                bm25.doc_freq[idx] = count
+            else:
+                bm25.doc_freq.pop(idx, None)
+    bm25.avgdl = total_length / bm25.n_docs if bm25.n_docs > 0 else 0.0
+
+def update_bm25_for_user(user_id: str, added_texts: list = (), removed_texts: list = ()):
+    """Incrementally update the user's BM25 statistics.
+
+    Call it after the vectors, chunk store and manifest reflect the
+    change, so a failed ingest never leaves a delta applied. Updates are
+    serialized per user across processes. Cost is proportional to the
+    changed texts; falls back to a full fit over the chunk store when the
+    user has no cached encoder.
+    """
+    try:
+        with redis_lock(bm25_key(user_id)):
+            bm25 = load_user_bm25_for_update(user_id)
+            if bm25 is None or bm25.doc_freq is None:
+                train_bm25_for_user(user_id)
+                return True
+            
+            _adjust_bm25_stats(bm25, added_texts, 1)
+            _adjust_bm25_stats(bm25, removed_texts, -1)
+            
+            if bm25.n_docs > 0:
+                save_user_bm25(user_id, bm25)
+            else:
+                delete_user_bm25(user_id)
+            return True
+        
+    except Exception as e:
+        print(f"❌ BM25 update error: {e}")
+        # Drop the encoder so the next change refits it instead of compounding drift
+        try:
+            delete_user_bm25(user_id)
+        except Exception:
+            pass
+        return False
+
+def fetch_chunk_texts(user_id: str, chunk_ids: list, batch_size: int = 100) -> dict:
+    """Get {chunk_id: text} for stored chunks in the user's namespace.
+
+    Reads the local chunk store; only chunks missing there (ingested
+    before it existed) are fetched from the index metadata.
+    """
+    texts = get_chunk_store(user_id).get_many(chunk_ids)
+    missing = [chunk_id for chunk_id in chunk_ids if chunk_id not in texts]
+    if not missing:
+        return texts
+    
+    index = get_index()
+    for i in range(0, len(missing), batch_size):
+        response = index.fetch(ids=missing[i:i + batch_size], namespace=user_id)
+        for chunk_id, vector in response.vectors.items():
+            if vector.metadata and "text" in vector.metadata:
+                texts[chunk_id] = vector.metadata["text"]
+    return texts
+
+def hybrid_scale(dense_vector: list, sparse_vector: dict, alpha: float = None):
+    """Convex dense/sparse weighting: alpha=1 is pure dense, alpha=0 pure BM25.
+
+    alpha=None leaves both unscaled.
+    """
+    if alpha is None:
+        return dense_vector, sparse_vector
+    if not 0 <= alpha <= 1:
+        raise ValueError("❌ alpha must be between 0 and 1")
+    return (
+        [value * alpha for value in dense_vector],
+        {
+            "indices": sparse_vector["indices"],
+            "values": [value * (1 - alpha) for value in sparse_vector["values"]]
+        }
+    )
+
+def hybrid_search(user_id: str, query: str, top_k: int = None, dense_vector: list = None, bm25=None,
+                  alpha: float = None, score_threshold: float = None):
+    """Hybrid search with user isolation (pass dense_vector/bm25 if already loaded).
+
+    top_k, alpha and score_threshold default to the retrieval_* settings.
+    """
+    top_k = top_k or settings.retrieval_top_k
+    alpha = settings.retrieval_alpha if alpha is None else alpha
+    score_threshold = settings.retrieval_score_threshold if score_threshold is None else score_threshold
     try:
-        pc = get_pinecone()
-        index = pc.Index(settings.pinecone_index_name)
+        index = get_index()
         
         # Dense vector (semantic)
-        dense_vector = generate_embedding_query(query)
+        if dense_vector is None:
+            dense_vector = generate_embedding_query(query)
         
         # Sparse vector (keyword BM25) - user-specific
-        bm25 = get_user_bm25(user_id)
+        if bm25 is None:
+            bm25 = get_user_bm25(user_id)
         sparse_vector = bm25.encode_queries(query)
+        dense_vector, sparse_vector = hybrid_scale(dense_vector, sparse_vector, alpha)
         
         # Hybrid search in user's namespace
         results = index.query(
@@ -78,11 +307,14 @@ def hybrid_search(user_id: str, query: str, top_k: int = 5):
             vector=dense_vector,
             sparse_vector=sparse_vector,
             top_k=top_k,
-            include_metadata=True,
+            include_metadata=False,
             filter={"user_id": user_id}  # Extra safety
         )
         
-        return [match.metadata["text"] for match in results.matches if match.score > 0.5]
+        # Texts come from the chunk store, not the query payload
+        chunk_ids = [match.id for match in results.matches if match.score > score_threshold]
+        texts = fetch_chunk_texts(user_id, chunk_ids)
+        return [texts[chunk_id] for chunk_id in chunk_ids if chunk_id in texts]
         
     except Exception as e:
         print(f"❌ Hybrid search error: {e}")
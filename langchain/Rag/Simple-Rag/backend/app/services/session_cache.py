@@ -0,0 +1,186 @@
+# services/session_cache.py
+"""
+Per-user cache of retrieval state, filled ahead of the first query by
+services/session_warmup.py and read on the query path.
+
+    bm25      fitted encoder, tagged with the namespace version it was
+              loaded at (a newer version means the documents changed)
+    user      user record
+    chats     {chat_id: (chat record, recent chat context, newest history entry)}
+
+The query path (services/search.py fetch_query_state) serves chat
+context from here after checking the newest history entry in the same
+Redis round trip it makes anyway, so the "context" hit rate is the share
+of queries that found their chat warm.
+
+Memory is bounded by entry count and by the approximate size of the
+cached encoders; the least recently used users are evicted first.
+Records and chat context expire after session_cache_ttl seconds.
+Cached encoders are shared: read them, never fit them in place.
+"""
+import threading
+import time
+from collections import OrderedDict
+from app.config.settings import settings
+
+RECORD_BYTES = 2048  # rough size of one cached record / chat context
+
+
+class _Entry:
+    def __init__(self):
+        self.bm25 = None  # (namespace_version, encoder)
+        self.bm25_bytes = 0
+        self.user = None  # (loaded_at, record)
+        self.chats = {}  # chat_id -> (loaded_at, record or None, chat_context, history head)
+        self.warmed = {}  # chat_id (None = user level) -> last prefetch
+
+    @property
+    def size(self) -> int:
+        return self.bm25_bytes + RECORD_BYTES * (int(self.user is not None) + 2 * len(self.chats))
+
+
+class SessionCache:
+    def __init__(self, max_users: int, max_bytes: int, ttl: int):
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.evictions = 0
+        self.hits = {"bm25": 0, "user": 0, "chat": 0, "context": 0}
+        self.misses = {"bm25": 0, "user": 0, "chat": 0, "context": 0}
+
+    def _entry(self, user_id: str, create: bool = False):
+        entry = self._entries.get(user_id)
+        if entry is None and create:
+            entry = self._entries[user_id] = _Entry()
+        if entry is not None:
+            self._entries.move_to_end(user_id)
+        return entry
+
+    def _update(self, user_id: str, apply):
+        with self._lock:
+            entry = self._entry(user_id, create=True)
+            self._bytes -= entry.size
+            apply(entry)
+            self._bytes += entry.size
+            self._evict()
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_users or self._bytes > self.max_bytes):
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+            self.evictions += 1
+
+    def _fresh(self, loaded_at: float) -> bool:
+        return time.monotonic() - loaded_at < self.ttl
+
+    def record(self, kind: str, hit: bool):
+        with self._lock:
+            (self.hits if hit else self.misses)[kind] += 1
+
+    # BM25 encoders (validated against the namespace version by the caller)
+    def peek_bm25(self, user_id: str):
+        """(namespace_version, encoder) or None, without counting a hit or miss"""
+        with self._lock:
+            entry = self._entry(user_id)
+            return entry.bm25 if entry else None
+
+    def put_bm25(self, user_id: str, namespace_version: int, encoder, size: int):
+        def apply(entry):
+            entry.bm25 = (namespace_version, encoder)
+            entry.bm25_bytes = size
+        self._update(user_id, apply)
+
+    # User and chat records
+    def get_user(self, user_id: str):
+        with self._lock:
+            entry = self._entry(user_id)
+            hit = entry is not None and entry.user is not None and self._fresh(entry.user[0])
+            (self.hits if hit else self.misses)["user"] += 1
+            return entry.user[1] if hit else None
+
+    def put_user(self, user_id: str, record: dict):
+        self._update(user_id, lambda entry: setattr(entry, "user", (time.monotonic(), record)))
+
+    def get_chat(self, user_id: str, chat_id: str):
+        """(chat record, chat context) or None"""
+        with self._lock:
+            entry = self._entry(user_id)
+            cached = entry.chats.get(chat_id) if entry else None
+            hit = cached is not None and cached[1] is not None and self._fresh(cached[0])
+            (self.hits if hit else self.misses)["chat"] += 1
+            return cached[1:3] if hit else None
+
+    def put_chat(self, user_id: str, chat_id: str, record: dict, chat_context: str, head: str = None):
+        self._update(user_id, lambda entry: entry.chats.__setitem__(
+            chat_id, (time.monotonic(), record, chat_context, head)))
+
+    def peek_chat_context(self, user_id: str, chat_id: str):
+        """(chat context, history head it was read at) or None, without counting a hit or miss"""
+        with self._lock:
+            entry = self._entry(user_id)
+            cached = entry.chats.get(chat_id) if entry else None
+            return cached[2:] if cached is not None and self._fresh(cached[0]) else None
+
+    def put_chat_context(self, user_id: str, chat_id: str, chat_context: str, head: str = None):
+        """Cache context read on the query path (keeps a cached record only if it is still fresh)"""
+        def apply(entry):
+            cached = entry.chats.get(chat_id)
+            if cached is not None and cached[1] is not None and self._fresh(cached[0]):
+                entry.chats[chat_id] = (cached[0], cached[1], chat_context, head)
+            else:
+                entry.chats[chat_id] = (time.monotonic(), None, chat_context, head)
+        self._update(user_id, apply)
+
+    def mark_warmed(self, user_id: str, chat_id: str = None):
+        self._update(user_id, lambda entry: entry.warmed.__setitem__(chat_id, time.monotonic()))
+
+    def warm(self, user_id: str, chat_id: str = None) -> bool:
+        """True if this user (and chat) was prefetched within the TTL and is still cached"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            warmed_at = entry.warmed.get(chat_id) if entry else None
+            return warmed_at is not None and entry.bm25 is not None and self._fresh(warmed_at)
+
+    def invalidate(self, user_id: str, chat_id: str = None):
+        """Drop cached records after a write (token usage, new messages).
+
+        The encoder stays; records are reloaded on the next read.
+        """
+        def apply(entry):
+            entry.user = None
+            if chat_id is None:
+                entry.chats.clear()
+            else:
+                entry.chats.pop(chat_id, None)
+        with self._lock:
+            if user_id not in self._entries:
+                return
+        self._update(user_id, apply)
+
+    def stats(self) -> dict:
+        with self._lock:
+            hit_rate = {
+                kind: round(self.hits[kind] / (self.hits[kind] + self.misses[kind]), 3)
+                if self.hits[kind] + self.misses[kind] else None
+                for kind in self.hits
+            }
+            return {
+                "users": len(self._entries),
+                "approx_bytes": self._bytes,
+                "max_users": self.max_users,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "hits": dict(self.hits),
+                "misses": dict(self.misses),
+                "hit_rate": hit_rate,
+            }
+
+
+session_cache = SessionCache(
+    settings.session_cache_max_users,
+    settings.session_cache_max_mb * 1024 * 1024,
+    settings.session_cache_ttl,
+)
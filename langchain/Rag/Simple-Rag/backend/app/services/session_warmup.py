@@ -0,0 +1,131 @@
+# services/session_warmup.py
+"""
+Predictive warmup: when a user is identified, load the state their first
+query will need into services/session_cache.py in the background, so
+that query does not pay every cold cost at once:
+
+    BM25 encoder, user record, embedding model
+    the session_warmup_chats most recently updated chats: record and
+    recent context (one Mongo query, one Redis round trip)
+
+The query path reads the encoder and the chat context from the cache;
+opening a chat (get_chat_state) reads the records.
+
+Prefetches run on a small thread pool and are deduplicated per user;
+state that is already warm is not loaded again.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from app.config.settings import settings
+from app.database.redis import run_pipeline
+from app.database.models.models import get_user_by_id, get_chat, get_user_chats, queue_chat_head, queue_chat_context, format_chat_context
+from services.embeddings import get_embeddings
+from services.search import prefetch_user_bm25
+from services.session_cache import session_cache
+
+
+class WarmupStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.scheduled = 0
+        self.skipped = 0
+        self.completed = 0
+        self.failed = 0
+
+    def add(self, field: str):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "scheduled": self.scheduled,
+                "skipped": self.skipped,
+                "completed": self.completed,
+                "failed": self.failed,
+            }
+
+stats = WarmupStats()
+_pending = set()
+_pending_lock = threading.Lock()
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.session_warmup_workers,
+                                           thread_name_prefix="session-warmup")
+        return _executor
+
+
+def get_user_record(user_id: str):
+    """User record, from the session cache when warm"""
+    user = session_cache.get_user(user_id)
+    if user is None:
+        user = get_user_by_id(user_id)
+        if user is not None:
+            session_cache.put_user(user_id, user)
+    return user
+
+def _load_chats(user_id: str, chats: list):
+    """Cache records and recent context of several chats, reading Redis once"""
+    def build(pipe):
+        for chat in chats:
+            # Head first, like fetch_query_state
+            queue_chat_head(pipe, user_id, chat["chat_id"])
+            queue_chat_context(pipe, user_id, chat["chat_id"])
+
+    results = run_pipeline(build) if chats else []
+    for chat, head, messages in zip(chats, results[::2], results[1::2]):
+        session_cache.put_chat(user_id, chat["chat_id"], chat, format_chat_context(messages), head)
+
+def get_chat_state(user_id: str, chat_id: str):
+    """(chat record, recent chat context), from the session cache when warm"""
+    cached = session_cache.get_chat(user_id, chat_id)
+    if cached is None:
+        chat = get_chat(user_id, chat_id)
+        if chat is None:
+            return None, ""
+        _load_chats(user_id, [chat])
+        cached = session_cache.get_chat(user_id, chat_id) or (chat, "")
+    return cached
+
+def warm_session(user_id: str):
+    """Load a user's retrieval state into the session cache"""
+    get_embeddings()
+    prefetch_user_bm25(user_id)
+    user = get_user_by_id(user_id)
+    if user is not None:
+        session_cache.put_user(user_id, user)
+    if settings.session_warmup_chats:
+        _load_chats(user_id, get_user_chats(user_id, limit=settings.session_warmup_chats))
+    session_cache.mark_warmed(user_id)
+
+def _run(user_id: str):
+    try:
+        warm_session(user_id)
+        stats.add("completed")
+    except Exception as e:
+        print(f"❌ Session warmup failed for {user_id}: {e}")
+        stats.add("failed")
+    finally:
+        with _pending_lock:
+            _pending.discard(user_id)
+
+def prefetch_session(user_id: str) -> bool:
+    """Schedule a background warmup; returns False if it was not needed or already running"""
+    if not settings.session_warmup_enabled or not user_id:
+        return False
+    with _pending_lock:
+        if user_id in _pending or session_cache.warm(user_id):
+            stats.add("skipped")
+            return False
+        _pending.add(user_id)
+    stats.add("scheduled")
+    _get_executor().submit(_run, user_id)
+    return True
+
+def session_warmup_stats() -> dict:
+    return {"prefetch": stats.snapshot(), "cache": session_cache.stats()}
@@ -0,0 +1,582 @@
+# services/vector_store.py
+"""
+Local (in-process / self-hosted) vector index with compact storage.
+
+Each namespace keeps its full float32 vectors in a memory-mapped file on
+disk and only a quantized copy in RAM:
+
+- "int8":   one byte per dimension (4x smaller than float32)
+- "binary": one bit per dimension (32x smaller)
+- "none":   no quantized copy, exact search straight off the memmap
+
+Next to the codes, RAM holds 25 bytes per row: a 64-bit id hash, the
+row's offset in records.jsonl and a live flag, plus a sorted hash -> row
+lookup. Ids and metadata stay on disk and are read back only for the
+rows a query returns (or filters on).
+
+A query scores the quantized copy, keeps k * oversample candidates and
+rescores them exactly against the float vectors. LocalIndex wraps the
+stores in the subset of the Pinecone Index API this app uses, so it can
+stand in for Pinecone when settings.vector_backend is "local".
+
+Each namespace directory holds:
+    vectors.f32     append-only float32 rows
+    records.jsonl   one line per row ({"id", "metadata"}) or per delete
+                    ({"delete": id}); later lines win
+    meta.json       dimension and int8 scale (replaced atomically)
+    CURRENT         generation number once the store has been compacted;
+                    generation N uses vectors.N.f32 / records.N.jsonl
+
+As in services/chunk_store.py, writers (ingestion workers, the API, the
+guest reaper) append under a file lock, and every process picks up new
+lines when records.jsonl grows and switches files when CURRENT changes.
+Deletes and replacements leave dead rows behind, so a write that pushes
+their share past compact_ratio rewrites the live rows into a new
+generation.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from types import SimpleNamespace
+import numpy as np
+
+QUANTIZATIONS = ("none", "int8", "binary")
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+_BLOCK = 65536
+SCALE_HEADROOM = 1.25  # int8 range grows in steps, so rescales stay rare
+COMPACT_MIN_ROWS = 1024  # never bother compacting stores smaller than this
+
+
+def _key(vector_id: str) -> np.uint64:
+    return np.uint64(int.from_bytes(hashlib.blake2b(vector_id.encode("utf-8"), digest_size=8).digest(), "little"))
+
+
+class QuantizedVectorStore:
+    def __init__(self, path: str, dimension: int, quantization: str = "int8", oversample: int = 4,
+                 compact_ratio: float = 0.5):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"❌ Unknown quantization: {quantization} (expected one of {QUANTIZATIONS})")
+        self.path = path
+        self.dimension = dimension
+        self.quantization = quantization
+        self.oversample = oversample
+        self.compact_ratio = compact_ratio
+        self._lock = threading.RLock()
+
+        os.makedirs(path, exist_ok=True)
+        self._current_path = os.path.join(path, "CURRENT")
+        self._meta_path = os.path.join(path, "meta.json")
+        self._lock_path = os.path.join(path, "lock")
+
+        self._generation = None
+        self._current_inode = None
+        self._current_generation = 0
+        self._records_file = None
+        with self._lock, self._file_lock():
+            self._refresh()
+
+    # ---------- generations ----------
+
+    def _files(self, generation: int):
+        if generation == 0:
+            return os.path.join(self.path, "vectors.f32"), os.path.join(self.path, "records.jsonl")
+        return (os.path.join(self.path, f"vectors.{generation}.f32"),
+                os.path.join(self.path, f"records.{generation}.jsonl"))
+
+    def _read_generation(self) -> int:
+        try:
+            inode = os.stat(self._current_path).st_ino
+        except FileNotFoundError:
+            return 0
+        if inode != self._current_inode:
+            with open(self._current_path) as f:
+                self._current_inode = inode
+                self._current_generation = int(f.read().strip() or 0)
+        return self._current_generation
+
+    def _switch(self, generation: int):
+        """Forget every loaded row; the next refresh reads the generation from the start"""
+        self._generation = generation
+        self._vectors_path, self._records_path = self._files(generation)
+        if self._records_file is not None:
+            self._records_file.close()
+        self._records_file = None
+        self._records_inode = None
+        self._records_size = 0
+        self._meta_inode = None
+        self.scale = None
+        self._keys = np.zeros(0, dtype=np.uint64)
+        self._offsets = np.zeros(0, dtype=np.int64)
+        self._live = np.zeros(0, dtype=bool)
+        self._sorted_keys = np.zeros(0, dtype=np.uint64)
+        self._sorted_rows = np.zeros(0, dtype=np.int64)
+        self._floats = np.zeros((0, self.dimension), dtype=np.float32)
+        self.codes = self._empty_codes()
+
+    @contextmanager
+    def _file_lock(self):
+        """Cross-process writer lock (appends, scale changes and compaction)"""
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # ---------- reading ----------
+
+    def _records_stat(self):
+        """stat of the current records file, or None if it does not exist (yet)"""
+        for _ in range(3):
+            generation = self._read_generation()
+            if generation != self._generation:
+                self._switch(generation)
+            try:
+                return os.stat(self._records_path)
+            except FileNotFoundError:
+                if not generation:
+                    return None
+                # Compacted away between reading CURRENT and opening the records
+                self._current_inode = None
+        return None
+
+    def _refresh(self):
+        """Load rows, deletes and scale changes written since the last refresh (by any process)"""
+        stat = self._records_stat()
+        inode = stat.st_ino if stat else None
+        size = stat.st_size if stat else 0
+        if size < self._records_size or (self._records_size and inode != self._records_inode):
+            # Namespace dropped (and maybe recreated) by another process
+            self._switch(self._generation)
+        if inode != self._records_inode:
+            if self._records_file is not None:
+                self._records_file.close()
+            self._records_file = open(self._records_path, "rb") if stat else None
+            self._records_inode = inode
+
+        rescale = self.quantization == "int8" and self._read_meta()
+        if size > self._records_size:
+            self._apply(size, quantize=not rescale)
+        if self.quantization == "int8":
+            if self.scale is None and len(self._keys):
+                # Stores written before meta.json existed
+                self._grow_scale(self._floats)
+                rescale = self._read_meta() or rescale
+            if rescale:
+                self.codes = self._quantize_all()
+
+    def _read_meta(self) -> bool:
+        """Pick up a scale written by any process; True if meta.json changed"""
+        try:
+            inode = os.stat(self._meta_path).st_ino
+        except FileNotFoundError:
+            return False
+        if inode == self._meta_inode:
+            return False
+        with open(self._meta_path) as f:
+            meta = json.load(f)
+        self._meta_inode = inode
+        if meta.get("scale") is not None:
+            self.scale = np.asarray(meta["scale"], dtype=np.float32)
+        return True
+
+    def _apply(self, size: int, quantize: bool = True):
+        self._records_file.seek(self._records_size)
+        tail = self._records_file.read(size - self._records_size)
+        tail = tail[:tail.rfind(b"\n") + 1]  # ignore a half-written line
+        if not tail:
+            return
+
+        first = len(self._keys)
+        keys, offsets, dead, added = [], [], [], {}
+        position = self._records_size
+        for line in tail.splitlines(keepends=True):
+            record = json.loads(line)
+            if "delete" in record:
+                key = _key(record["delete"])
+                row = added.pop(key, None)
+            else:
+                key = _key(record["id"])
+                row = added.get(key)
+                added[key] = first + len(keys)
+                keys.append(key)
+                offsets.append(position)
+            if row is None:
+                row = self._find(key)
+            if row is not None:
+                dead.append(row)
+            position += len(line)
+
+        self._remap(first + len(keys))
+        self._keys = np.concatenate([self._keys, np.asarray(keys, dtype=np.uint64)])
+        self._offsets = np.concatenate([self._offsets, np.asarray(offsets, dtype=np.int64)])
+        self._live = np.concatenate([self._live, np.ones(len(keys), dtype=bool)])
+        self._live[np.asarray(dead, dtype=np.int64)] = False
+        self._records_size += len(tail)
+
+        live_rows = np.flatnonzero(self._live)
+        order = np.argsort(self._keys[live_rows], kind="stable")
+        self._sorted_keys = self._keys[live_rows][order]
+        self._sorted_rows = live_rows[order]
+
+        if quantize and keys and (self.quantization != "int8" or self.scale is not None):
+            new_codes = self._quantize_rows(first, first + len(keys))
+            if new_codes is not None:
+                self.codes = np.concatenate([self.codes, new_codes])
+
+    def _find(self, key: np.uint64):
+        """Row of the live vector with this id hash, or None"""
+        i = int(np.searchsorted(self._sorted_keys, key))
+        if i < len(self._sorted_keys) and self._sorted_keys[i] == key:
+            return int(self._sorted_rows[i])
+        return None
+
+    def _remap(self, rows: int):
+        if rows:
+            self._floats = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dimension))
+        else:
+            self._floats = np.zeros((0, self.dimension), dtype=np.float32)
+
+    def _read_records(self, rows) -> dict:
+        """{row: {"id", "metadata"}} read off records.jsonl, in file order"""
+        records = {}
+        for row in sorted(int(row) for row in rows):
+            self._records_file.seek(int(self._offsets[row]))
+            records[row] = json.loads(self._records_file.readline())
+        return records
+
+    def _save_meta(self, scale: np.ndarray):
+        tmp_path = self._meta_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"dimension": self.dimension, "scale": scale.tolist()}, f)
+        os.replace(tmp_path, self._meta_path)
+
+    # ---------- quantization ----------
+
+    def _empty_codes(self):
+        if self.quantization == "int8":
+            return np.zeros((0, self.dimension), dtype=np.int8)
+        if self.quantization == "binary":
+            return np.zeros((0, (self.dimension + 7) // 8), dtype=np.uint8)
+        return None
+
+    def _grow_scale(self, vectors: np.ndarray) -> bool:
+        """Widen the per-dimension int8 range in meta.json to cover `vectors`; True if it changed"""
+        needed = np.zeros(self.dimension, dtype=np.float32)
+        for i in range(0, len(vectors), _BLOCK):
+            needed = np.maximum(needed, np.abs(np.asarray(vectors[i:i + _BLOCK])).max(axis=0))
+        needed = np.clip(needed, 1e-6, None) / 127
+        if self.scale is not None and np.all(needed <= self.scale):
+            return False
+        grown = needed * SCALE_HEADROOM
+        self._save_meta(grown if self.scale is None else np.maximum(self.scale, grown).astype(np.float32))
+        return True
+
+    def _quantize(self, vectors: np.ndarray):
+        if self.quantization == "int8":
+            return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+        if self.quantization == "binary":
+            return np.packbits(vectors > 0, axis=1)
+        return None
+
+    def _quantize_rows(self, start: int, stop: int):
+        """Quantized copy of stored rows [start, stop), read off the memmap block by block"""
+        codes = self._empty_codes()
+        if codes is None or stop <= start:
+            return codes
+        codes = np.empty((stop - start, codes.shape[1]), dtype=codes.dtype)
+        for i in range(start, stop, _BLOCK):
+            codes[i - start:min(i + _BLOCK, stop) - start] = self._quantize(np.asarray(self._floats[i:min(i + _BLOCK, stop)]))
+        return codes
+
+    def _quantize_all(self):
+        return self._quantize_rows(0, len(self._keys))
+
+    def _approximate_scores(self, query: np.ndarray) -> np.ndarray:
+        if self.quantization == "int8":
+            weights = query * self.scale
+            return np.concatenate([
+                self.codes[i:i + _BLOCK].astype(np.float32) @ weights
+                for i in range(0, len(self.codes), _BLOCK)
+            ])
+        if self.quantization == "binary":
+            packed = np.packbits(query > 0)
+            hamming = np.concatenate([
+                _POPCOUNT[np.bitwise_xor(self.codes[i:i + _BLOCK], packed)].sum(axis=1, dtype=np.int32)
+                for i in range(0, len(self.codes), _BLOCK)
+            ])
+            return (self.dimension - 2 * hamming).astype(np.float32)
+        return np.asarray(self._floats @ query, dtype=np.float32)
+
+    # ---------- writing ----------
+
+    def _append(self, lines: list, vectors: np.ndarray = None):
+        """Append rows / deletes under the file lock (the caller holds it and has refreshed)"""
+        rows = len(self._keys)
+        # Drop whatever a writer that died mid-append left past the last complete row
+        if os.path.exists(self._vectors_path) and os.path.getsize(self._vectors_path) > rows * self.dimension * 4:
+            os.truncate(self._vectors_path, rows * self.dimension * 4)
+        if os.path.exists(self._records_path) and os.path.getsize(self._records_path) > self._records_size:
+            os.truncate(self._records_path, self._records_size)
+
+        if vectors is not None:
+            with open(self._vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+        with open(self._records_path, "ab") as f:
+            f.write("".join(json.dumps(line) + "\n" for line in lines).encode("utf-8"))
+        self._refresh()
+
+    def dead_ratio(self) -> float:
+        """Share of stored rows that were deleted or replaced"""
+        with self._lock:
+            self._refresh()
+            rows = len(self._keys)
+            return 1 - len(self._sorted_rows) / rows if rows else 0.0
+
+    def _maybe_compact(self):
+        rows = len(self._keys)
+        if rows >= COMPACT_MIN_ROWS and 1 - len(self._sorted_rows) / rows > self.compact_ratio:
+            self.compact()
+
+    def compact(self) -> int:
+        """Rewrite the live rows into a new generation; returns the number of rows reclaimed"""
+        with self._lock, self._file_lock():
+            self._refresh()
+            rows = len(self._keys)
+            live_rows = np.flatnonzero(self._live)
+            old_files = (self._vectors_path, self._records_path)
+            generation = self._generation + 1
+            vectors_path, records_path = self._files(generation)
+
+            with open(vectors_path, "wb") as vectors_file, open(records_path, "wb") as records_file:
+                for i in range(0, len(live_rows), _BLOCK):
+                    block = live_rows[i:i + _BLOCK]
+                    vectors_file.write(np.asarray(self._floats[block]).tobytes())
+                    for row in block:
+                        self._records_file.seek(int(self._offsets[row]))
+                        records_file.write(self._records_file.readline())
+                for f in (vectors_file, records_file):
+                    f.flush()
+                    os.fsync(f.fileno())
+
+            tmp_path = self._current_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                f.write(str(generation))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._current_path)
+
+            self._refresh()
+            for file_path in old_files:
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+            return rows - len(live_rows)
+
+    # ---------- public API ----------
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._sorted_rows)
+
+    def memory_bytes(self) -> int:
+        """Bytes held in RAM for candidate search (float vectors, ids and metadata stay on disk)"""
+        with self._lock:
+            index = sum(array.nbytes for array in (
+                self._keys, self._offsets, self._live, self._sorted_keys, self._sorted_rows))
+            if self.codes is None:
+                return index + len(self._keys) * self.dimension * 4
+            return index + int(self.codes.nbytes)
+
+    def upsert(self, ids: list[str], vectors, metadata: list[dict] = None):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+        metadata = metadata or [{} for _ in ids]
+        with self._lock:
+            with self._file_lock():
+                self._refresh()
+                if self.quantization == "int8" and self._grow_scale(vectors):
+                    # New data is out of range: every process requantizes at the wider scale
+                    self._read_meta()
+                    self.codes = self._quantize_all()
+                self._append([{"id": vector_id, "metadata": meta} for vector_id, meta in zip(ids, metadata)],
+                             vectors)
+            self._maybe_compact()
+
+    def delete(self, ids: list[str]):
+        with self._lock:
+            with self._file_lock():
+                self._refresh()
+                deletes = [{"delete": vector_id} for vector_id in ids if self._find(_key(vector_id)) is not None]
+                if not deletes:
+                    return
+                self._append(deletes)
+            self._maybe_compact()
+
+    def fetch(self, ids: list[str]) -> dict:
+        with self._lock:
+            self._refresh()
+            rows = {vector_id: self._find(_key(vector_id)) for vector_id in ids}
+            rows = {vector_id: row for vector_id, row in rows.items() if row is not None}
+            records = self._read_records(rows.values())
+            return {
+                vector_id: (np.asarray(self._floats[row]).tolist(), records[row].get("metadata", {}))
+                for vector_id, row in rows.items() if records[row]["id"] == vector_id
+            }
+
+    def find_ids(self, filter: dict) -> list[str]:
+        """Ids of live vectors whose metadata matches every key in filter (reads every record)"""
+        with self._lock:
+            self._refresh()
+            records = self._read_records(np.flatnonzero(self._live))
+            return [
+                record["id"] for record in records.values()
+                if all(record.get("metadata", {}).get(key) == value for key, value in filter.items())
+            ]
+
+    def sample(self, count: int) -> np.ndarray:
+        """Float vectors of up to `count` live rows spread over the store"""
+        with self._lock:
+            self._refresh()
+            live_rows = np.flatnonzero(self._live)
+            rows = live_rows[::max(1, len(live_rows) // count)][:count]
+            return np.asarray(self._floats[rows])
+
+    def search(self, query, top_k: int = 5, oversample: int = None, filter: dict = None):
+        """Approximate candidate search followed by exact float rescoring.
+
+        Returns a list of (id, score, metadata), best first.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        with self._lock:
+            self._refresh()
+            if not len(self._sorted_rows):
+                return []
+            scores = self._approximate_scores(query)
+            scores[~self._live] = -np.inf
+
+            n_candidates = min(len(self._sorted_rows), top_k * (oversample or self.oversample))
+            candidates = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+            candidates = candidates[np.isfinite(scores[candidates])]
+            records = {}
+            if filter:
+                # Applied to the candidates only; namespaces already isolate tenants
+                records = self._read_records(candidates)
+                candidates = np.array([
+                    row for row in candidates
+                    if all(records[row].get("metadata", {}).get(key) == value for key, value in filter.items())
+                ], dtype=np.int64)
+                if not len(candidates):
+                    return []
+
+            if self.quantization != "none":
+                # Sorted row order keeps memmap reads sequential
+                candidates = np.sort(candidates)
+                exact = np.asarray(self._floats[candidates]) @ query
+            else:
+                exact = scores[candidates]
+
+            best = [int(candidates[i]) for i in np.argsort(-exact)[:top_k]]
+            scores_by_row = dict(zip(candidates.tolist(), exact.tolist()))
+            if not filter:
+                records = self._read_records(best)
+            return [
+                (records[row]["id"], float(scores_by_row[row]), records[row].get("metadata", {}))
+                for row in best
+            ]
+
+    def calibrate(self, queries, top_k: int = 5, target_recall: float = 0.95, max_oversample: int = 64) -> int:
+        """Pick the smallest oversample factor that reaches target recall@k on sample queries"""
+        queries = np.asarray(queries, dtype=np.float32)
+        exact = [
+            {hit[0] for hit in self.search(q, top_k, oversample=max(1, len(self) // top_k + 1))}
+            for q in queries
+        ]
+        oversample = 1
+        while oversample < max_oversample:
+            recall = np.mean([
+                len(truth & {hit[0] for hit in self.search(q, top_k, oversample=oversample)}) / max(len(truth), 1)
+                for q, truth in zip(queries, exact)
+            ])
+            if recall >= target_recall:
+                break
+            oversample *= 2
+        self.oversample = oversample
+        return oversample
+
+    def close(self):
+        with self._lock:
+            if self._records_file is not None:
+                self._records_file.close()
+                self._records_file = None
+
+
+class LocalIndex:
+    """Pinecone-Index-compatible wrapper around one QuantizedVectorStore per namespace.
+
+    Sparse vectors are not supported locally; queries are dense-only.
+    """
+
+    def __init__(self, root: str, dimension: int, quantization: str = "int8", oversample: int = 4,
+                 recall_target: float = None, top_k: int = 5, compact_ratio: float = 0.5):
+        self.root = root
+        self.dimension = dimension
+        self.quantization = quantization
+        self.oversample = oversample
+        self.compact_ratio = compact_ratio
+        self.recall_target = recall_target
+        self.top_k = top_k
+        self._stores = {}
+        self._lock = threading.Lock()
+
+    def store(self, namespace: str) -> QuantizedVectorStore:
+        with self._lock:
+            if namespace not in self._stores:
+                store = QuantizedVectorStore(
+                    os.path.join(self.root, namespace or "_default"),
+                    self.dimension, self.quantization, self.oversample, self.compact_ratio,
+                )
+                if self.recall_target and self.quantization != "none" and len(store) >= 1000:
+                    # Tune the oversample factor on a sample of the tenant's own vectors
+                    store.calibrate(store.sample(32), self.top_k, self.recall_target)
+                self._stores[namespace] = store
+            return self._stores[namespace]
+
+    def upsert(self, vectors, namespace: str = ""):
+        ids, values, metadata = zip(*vectors)
+        self.store(namespace).upsert(list(ids), list(values), list(metadata))
+        return {"upserted_count": len(ids)}
+
+    def query(self, vector, top_k: int = 5, namespace: str = "", include_metadata: bool = False,
+              filter: dict = None, sparse_vector=None, **kwargs):
+        hits = self.store(namespace).search(vector, top_k, filter=filter)
+        return SimpleNamespace(matches=[
+            SimpleNamespace(id=i, score=score, metadata=meta if include_metadata else None)
+            for i, score, meta in hits
+        ])
+
+    def fetch(self, ids: list[str], namespace: str = ""):
+        found = self.store(namespace).fetch(ids)
+        return SimpleNamespace(vectors={
+            i: SimpleNamespace(id=i, values=values, metadata=meta)
+            for i, (values, meta) in found.items()
+        })
+
+    def delete(self, ids: list[str] = None, namespace: str = "", delete_all: bool = False,
+               filter: dict = None, **kwargs):
+        if filter and not ids:
+            ids = self.store(namespace).find_ids(filter)
+        if delete_all:
+            with self._lock:
+                store = self._stores.pop(namespace, None)
+            if store is not None:
+                store.close()
+            # Other processes notice the missing records file and start over
+            shutil.rmtree(os.path.join(self.root, namespace or "_default"), ignore_errors=True)
+        elif ids:
+            self.store(namespace).delete(ids)
+        return {}
@@ -0,0 +1,44 @@
+# services/warmup.py
+import threading
+from app.lazy import readiness
+from app.database.mongodb import warmup_mongodb
+from app.database.pinecone import warmup_pinecone
+from app.database.redis import warmup_redis
+from services.embeddings import warmup_embeddings
+from services.runnabble import get_llm
+
+
+def warmup() -> dict:
+    """Preload every client and run one dummy embedding.
+
+    A component that fails to warm up is reported, not raised, so one
+    unreachable service does not keep the worker from serving.
+    """
+    steps = {
+        "embeddings": warmup_embeddings,
+        "pinecone": warmup_pinecone,
+        "mongodb": warmup_mongodb,
+        "redis": warmup_redis,
+        "llm": get_llm,
+    }
+    results = {}
+    for name, step in steps.items():
+        try:
+            results[name] = bool(step())
+        except Exception as e:
+            print(f"❌ Warmup failed for {name}: {e}")
+            results[name] = False
+    return results
+
+def start_warmup():
+    """Run warmup in a background thread so startup is not blocked."""
+    thread = threading.Thread(target=warmup, name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+def get_readiness() -> dict:
+    components = readiness()
+    return {
+        "ready": bool(components) and all(c["ready"] for c in components.values() if c["required"]),
+        "components": components,
+    }
@@ -0,0 +1,73 @@
+# benchmarks/embedding_backends.py
+"""
+Parity and throughput check for the embedding backends.
+
+    python benchmarks/embedding_backends.py --corpus some_file.txt
+
+Compares every ONNX variant against the fp32 torch model on cosine
+similarity and reports texts/second for each backend.
+"""
+import argparse
+import os
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [BACKEND_DIR, os.path.join(BACKEND_DIR, "app")]
+
+from app.config.settings import settings
+from services.embedding_backends import TorchBackend, OnnxBackend, parity_check
+
+
+def load_texts(corpus: str, count: int) -> list[str]:
+    if corpus:
+        with open(corpus, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+    else:
+        texts = [
+            f"Sample passage {i} about retrieval augmented generation, vector search "
+            f"and keyword ranking with BM25 over user documents."
+            for i in range(count)
+        ]
+    return (texts * (count // max(len(texts), 1) + 1))[:count]
+
+def throughput(model, texts: list[str], batch_size: int) -> float:
+    model.embed_documents(texts[:batch_size])  # warm caches
+    started = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        model.embed_documents(texts[i:i + batch_size])
+    return len(texts) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--corpus", help="text file, one passage per line")
+    parser.add_argument("--texts", type=int, default=512)
+    parser.add_argument("--batch-size", type=int, default=settings.embedding_batch_size)
+    parser.add_argument("--min-cosine", type=float, default=0.98,
+                        help="fail if the mean cosine of a backend falls below this")
+    args = parser.parse_args()
+
+    texts = load_texts(args.corpus, args.texts)
+    reference = TorchBackend(settings.embedding_model)
+    backends = {
+        "torch-fp32": reference,
+        "onnx-fp32": OnnxBackend(settings.embedding_model, settings.embedding_onnx_dir,
+                                 quantize=False, batch_size=args.batch_size),
+        "onnx-int8": OnnxBackend(settings.embedding_model, settings.embedding_onnx_dir,
+                                 quantize=True, batch_size=args.batch_size),
+    }
+
+    failed = False
+    print(f"{'backend':<12} {'texts/s':>10} {'mean cos':>10} {'min cos':>10}")
+    for name, model in backends.items():
+        rate = throughput(model, texts, args.batch_size)
+        parity = parity_check(reference, model, texts[:256])
+        failed |= parity["mean_cosine"] < args.min_cosine
+        print(f"{name:<12} {rate:>10.1f} {parity['mean_cosine']:>10.4f} {parity['min_cosine']:>10.4f}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
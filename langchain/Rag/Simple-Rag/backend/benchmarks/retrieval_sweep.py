@@ -0,0 +1,191 @@
+# benchmarks/retrieval_sweep.py
+"""
+Offline quality-vs-latency sweep for hybrid retrieval settings.
+
+    python benchmarks/retrieval_sweep.py corpus.json --csv results.csv
+
+corpus.json:
+    {
+      "documents": [{"id": "a", "text": "..."}, {"path": "docs/b.pdf"}],
+      "queries":   [{"query": "...", "relevant": ["passage that answers it", ...]}]
+    }
+
+Documents go through the real split_docs and embedding code into a
+local in-memory index shaped like the one ingestion writes: dense
+vectors only, since store_docs_in_pinecone upserts no sparse values.
+Queries are BM25-encoded with an encoder fitted on the chunks (as per
+user) and alpha-scaled exactly like hybrid_search, so the sparse half
+matches nothing and alpha only scales dense scores against the
+threshold. For every (chunk_size, chunk_overlap, alpha, top_k,
+score_threshold) the sweep records recall@k, MRR, prompt tokens per
+query and p95 retrieval latency (query embedding + BM25 encoding +
+scoring), then marks the Pareto-optimal configurations (recall and MRR
+up, tokens and latency down). alpha "none" is the unweighted production
+default and is always swept.
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [BACKEND_DIR, os.path.join(BACKEND_DIR, "app")]
+
+from langchain_core.documents import Document
+from pinecone_text.sparse import BM25Encoder
+from services.DocsLoader import docs_loader, split_docs
+from services.embeddings import generate_embedding_docs, generate_embedding_query
+from services.runnabble import count_tokens
+from services.search import hybrid_scale
+
+
+def load_corpus(path: str):
+    with open(path, encoding="utf-8") as f:
+        corpus = json.load(f)
+    documents = []
+    for doc in corpus["documents"]:
+        if "path" in doc:
+            documents.extend(docs_loader(doc["path"]))
+        else:
+            documents.append(Document(page_content=doc["text"], metadata={"source": doc.get("id", "")}))
+    return documents, corpus["queries"]
+
+def _tokens(text: str) -> set:
+    return set(text.lower().split())
+
+def is_relevant(chunk: str, passage: str, min_overlap: float) -> bool:
+    """A chunk answers a passage if it contains most of the passage's words"""
+    passage_tokens = _tokens(passage)
+    if not passage_tokens:
+        return False
+    return len(passage_tokens & _tokens(chunk)) / len(passage_tokens) >= min_overlap
+
+
+class LocalHybridIndex:
+    """In-memory dense matrix, queried the way hybrid_search queries the tenant's index"""
+
+    def __init__(self, chunks: list[str]):
+        self.chunks = chunks
+        self.dense = np.asarray(generate_embedding_docs(chunks), dtype=np.float32)
+        self.bm25 = BM25Encoder()
+        self.bm25.fit(chunks)
+
+    def search(self, query: str, dense_query: list, top_k: int, alpha, score_threshold: float):
+        # The sparse vector is built and scaled like in production, but no
+        # stored vector has sparse values for it to match
+        dense_vector, _ = hybrid_scale(dense_query, self.bm25.encode_queries(query), alpha)
+        scores = self.dense @ np.asarray(dense_vector, dtype=np.float32)
+        order = np.argsort(-scores)[:top_k]
+        return [int(row) for row in order if scores[row] > score_threshold]
+
+
+def embed_queries(queries):
+    """Query vectors plus the time each embedding took (ms); it is part of retrieval latency"""
+    vectors, embed_ms = [], []
+    for item in queries:
+        started = time.perf_counter()
+        vectors.append(generate_embedding_query(item["query"]))
+        embed_ms.append((time.perf_counter() - started) * 1000)
+    return vectors, embed_ms
+
+def evaluate(index, queries, query_vectors, embed_ms, top_k, alpha, score_threshold, min_overlap):
+    recalls, reciprocal_ranks, tokens, latencies = [], [], [], []
+    for item, dense_query, embedding_ms in zip(queries, query_vectors, embed_ms):
+        started = time.perf_counter()
+        rows = index.search(item["query"], dense_query, top_k, alpha, score_threshold)
+        latencies.append(embedding_ms + (time.perf_counter() - started) * 1000)
+
+        retrieved = [index.chunks[row] for row in rows]
+        relevant = item["relevant"]
+        covered = sum(any(is_relevant(chunk, passage, min_overlap) for chunk in retrieved) for passage in relevant)
+        recalls.append(covered / len(relevant) if relevant else 0.0)
+
+        rank = next((
+            position for position, chunk in enumerate(retrieved, 1)
+            if any(is_relevant(chunk, passage, min_overlap) for passage in relevant)
+        ), None)
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+        tokens.append(count_tokens("\n".join(retrieved)))
+
+    return {
+        "recall": float(np.mean(recalls)),
+        "mrr": float(np.mean(reciprocal_ranks)),
+        "prompt_tokens": float(np.mean(tokens)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+    }
+
+def mark_pareto(rows: list[dict]):
+    up, down = ("recall", "mrr"), ("prompt_tokens", "p95_ms")
+
+    def dominates(a, b):
+        no_worse = all(a[k] >= b[k] for k in up) and all(a[k] <= b[k] for k in down)
+        better = any(a[k] > b[k] for k in up) or any(a[k] < b[k] for k in down)
+        return no_worse and better
+
+    for row in rows:
+        row["pareto"] = not any(dominates(other, row) for other in rows if other is not row)
+
+
+def parse_alpha(value: str):
+    return None if value.lower() == "none" else float(value)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("corpus", help="labeled corpus JSON (see module docstring)")
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[500, 1000, 1500])
+    parser.add_argument("--chunk-overlaps", type=int, nargs="+", default=[100, 200])
+    parser.add_argument("--alphas", type=parse_alpha, nargs="+", default=[None, 0.3, 0.5, 0.7, 1.0],
+                        help='dense weight per run; "none" = unweighted (the default RETRIEVAL_ALPHA)')
+    parser.add_argument("--top-ks", type=int, nargs="+", default=[3, 5, 8])
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.0, 0.3, 0.5])
+    parser.add_argument("--min-overlap", type=float, default=0.6,
+                        help="share of a relevant passage's words a chunk must contain")
+    parser.add_argument("--csv", help="also write all rows to this CSV file")
+    parser.add_argument("--pareto-only", action="store_true")
+    args = parser.parse_args()
+
+    documents, queries = load_corpus(args.corpus)
+    query_vectors, embed_ms = embed_queries(queries)
+
+    rows = []
+    for chunk_size, chunk_overlap in itertools.product(args.chunk_sizes, args.chunk_overlaps):
+        if chunk_overlap >= chunk_size:
+            continue
+        chunks = [chunk.page_content for chunk in split_docs(documents, chunk_size, chunk_overlap)]
+        index = LocalHybridIndex(chunks)
+        print(f"chunk_size={chunk_size} overlap={chunk_overlap}: {len(chunks)} chunks", file=sys.stderr)
+
+        # The unweighted production default is always part of the sweep
+        alphas = args.alphas if None in args.alphas else [None] + args.alphas
+        for alpha, top_k, threshold in itertools.product(alphas, args.top_ks, args.thresholds):
+            result = evaluate(index, queries, query_vectors, embed_ms, top_k, alpha, threshold, args.min_overlap)
+            rows.append({
+                "chunk_size": chunk_size, "chunk_overlap": chunk_overlap, "alpha": alpha,
+                "top_k": top_k, "threshold": threshold, **result,
+            })
+
+    mark_pareto(rows)
+    rows.sort(key=lambda row: (-row["recall"], row["prompt_tokens"]))
+    shown = [row for row in rows if row["pareto"]] if args.pareto_only else rows
+
+    print(f"{'size':>5} {'overlap':>7} {'alpha':>5} {'k':>3} {'thresh':>6} "
+          f"{'recall':>7} {'MRR':>6} {'tokens':>7} {'p95 ms':>7}  pareto")
+    for row in shown:
+        alpha = "none" if row["alpha"] is None else f"{row['alpha']:.2f}"
+        print(f"{row['chunk_size']:>5} {row['chunk_overlap']:>7} {alpha:>5} {row['top_k']:>3} "
+              f"{row['threshold']:>6.2f} {row['recall']:>7.3f} {row['mrr']:>6.3f} "
+              f"{row['prompt_tokens']:>7.0f} {row['p95_ms']:>7.2f}  {'*' if row['pareto'] else ''}")
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    main()
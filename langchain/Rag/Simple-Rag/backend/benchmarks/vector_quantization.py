@@ -0,0 +1,111 @@
+# benchmarks/vector_quantization.py
+"""
+Memory, latency and recall@k of the local vector store per quantization level.
+
+    python benchmarks/vector_quantization.py --vectors 200000 --dimension 384
+
+Uses clustered synthetic embeddings by default, or a .npy file of real
+ones (--embeddings), stored with the metadata store_docs_in_pinecone
+writes. Recall is measured against exact float32 search. Memory is the
+Python heap the loaded store holds (tracemalloc, numpy included) and
+the growth of the process RSS while loading it (mapped float pages count
+once they are read).
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [BACKEND_DIR, os.path.join(BACKEND_DIR, "app")]
+
+from services.vector_store import QuantizedVectorStore
+
+
+def synthetic_embeddings(n: int, dimension: int, clusters: int = 256, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dimension)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, n)] + 0.6 * rng.normal(size=(n, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def rss_bytes() -> int:
+    """Resident set size of this process (Linux), 0 where /proc is unavailable"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return 0
+
+def load_store(path: str, dimension: int, quantization: str):
+    """Open a written store the way a serving process does; returns (store, heap bytes, RSS growth)"""
+    rss_before = rss_bytes()
+    tracemalloc.start()
+    store = QuantizedVectorStore(path, dimension, quantization)
+    heap = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return store, heap, rss_bytes() - rss_before
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, k: int) -> list[set]:
+    scores = queries @ vectors.T
+    return [set(np.argpartition(-row, k)[:k].tolist()) for row in scores]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--embeddings", help=".npy file of shape (n, dimension)")
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--oversample", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    if args.embeddings:
+        vectors = np.load(args.embeddings).astype(np.float32)
+    else:
+        vectors = synthetic_embeddings(args.vectors, args.dimension)
+    n, dimension = vectors.shape
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.integers(0, n, args.queries)] + 0.05 * rng.normal(size=(args.queries, dimension)).astype(np.float32)
+    truth = exact_top_k(vectors, queries, args.top_k)
+    float_bytes = n * dimension * 4
+
+    print(f"{n} vectors x {dimension} dims, float32 = {float_bytes / 2**20:.1f} MiB")
+    print(f"{'quant':<8} {'oversample':>10} {'heap MiB':>9} {'reduction':>9} {'RSS MiB':>8} {'est MiB':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'recall@' + str(args.top_k):>10}")
+
+    ids = [f"{i:064x}" for i in range(n)]  # chunk ids are sha256 hex digests
+    metadata = [
+        {"user_id": "guest_0123456789ab", "filename": "report.pdf", "chunk_index": i,
+         "created_at": "2025-01-01T00:00:00.000000"}
+        for i in range(n)
+    ]
+    for quantization in ("none", "int8", "binary"):
+        with tempfile.TemporaryDirectory() as path:
+            writer = QuantizedVectorStore(path, dimension, quantization)
+            writer.upsert(ids, vectors, metadata)
+            writer.close()
+            del writer
+            store, heap, rss = load_store(path, dimension, quantization)
+            levels = [1] if quantization == "none" else args.oversample
+
+            for oversample in levels:
+                latencies, recalls = [], []
+                for query, relevant in zip(queries, truth):
+                    started = time.perf_counter()
+                    hits = store.search(query, args.top_k, oversample=oversample)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    recalls.append(len(relevant & {int(h[0], 16) for h in hits}) / args.top_k)
+
+                print(f"{quantization:<8} {oversample:>10} {heap / 2**20:>9.1f} {float_bytes / heap:>8.1f}x "
+                      f"{rss / 2**20:>8.1f} {store.memory_bytes() / 2**20:>8.1f} {np.percentile(latencies, 50):>8.2f} {np.percentile(latencies, 95):>8.2f} "
+                      f"{np.mean(recalls):>10.3f}")
+            store.close()
+            del store
+
+
+if __name__ == "__main__":
+    main()
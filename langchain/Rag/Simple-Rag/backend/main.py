@@ -0,0 +1,201 @@
+# Run from the backend directory; modules import both app.* and services.*
+# (which lives under app/), so both roots go on the path:
+#     PYTHONPATH=.:app uvicorn main:app
+import asyncio
+import json
+import os
+import uuid
+from typing import Optional
+from fastapi import FastAPI, Request, Depends, UploadFile, File, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from app.config.settings import settings
+from app.middleware.auth import get_clerk_identity, determine_user_identity
+from app.database.redis import redis_metrics
+from app.database.models.models import touch_user_activity, check_user_limits, check_chat_limits, get_user_by_id, get_chat
+from services.warmup import start_warmup, get_readiness
+from services.DocsLoader import delete_document
+from services.ingestion_jobs import enqueue_ingestion, get_job
+from services.runnabble import abatch_query_rag_system
+from services.singleflight import singleflight_stats
+from services.guest_reaper import reaper_stats
+from services.session_warmup import get_user_record, get_chat_state, session_warmup_stats
+
+app = FastAPI(title=settings.app_name, debug=settings.debug)
+
+
+class BatchQuestion(BaseModel):
+    chat_id: str
+    prompt: str
+
+class BatchQueryRequest(BaseModel):
+    items: list[BatchQuestion] = Field(..., max_length=5000)
+    max_concurrency: Optional[int] = Field(default=None, ge=1)  # capped at BATCH_MAX_CONCURRENCY
+    save_history: bool = True
+
+
+def current_user_id(request: Request, identity: dict = Depends(get_clerk_identity)) -> str:
+    user_id, is_guest, email, username, guest_id = determine_user_identity(request, identity)
+    # Echoed back by guest_id_header so a new guest can keep using this id
+    request.state.guest_id = guest_id
+    request.state.is_guest = is_guest
+    returning_guest = is_guest and bool(request.headers.get("X-Guest-ID"))
+    if returning_guest or not is_guest:
+        # A guest without the header has no data yet; owner_user_id records it once it stores some
+        touch_user_activity(user_id, is_guest, create=returning_guest)
+    return user_id
+
+def owner_user_id(request: Request, user_id: str = Depends(current_user_id)) -> str:
+    """current_user_id for requests that store data: a new guest gets its user record first"""
+    if request.state.is_guest and not request.headers.get("X-Guest-ID"):
+        touch_user_activity(user_id, is_guest=True, create=True)
+    return user_id
+
+def save_upload(user_id: str, file: UploadFile) -> str:
+    """Write an uploaded file to the user's upload directory and return its path"""
+    user_dir = os.path.join(settings.upload_dir, user_id)
+    os.makedirs(user_dir, exist_ok=True)
+    filename = os.path.basename(file.filename or f"upload_{uuid.uuid4().hex[:8]}")
+    file_path = os.path.join(user_dir, filename)
+    with open(file_path, "wb") as f:
+        while chunk := file.file.read(1024 * 1024):
+            f.write(chunk)
+    return file_path
+
+def token_budgets(user_id: str, chat_ids: set):
+    """Remaining tokens for the user and each chat.
+
+    403 if the user is already over the limit, 404 if a chat does not
+    exist (its usage could not be recorded, so it would never hit a limit).
+    """
+    user_limits = check_user_limits(get_user_by_id(user_id) or {})
+    if user_limits["user_limit_exceeded"]:
+        raise HTTPException(status_code=403, detail=user_limits["user_message"])
+    user_budgets = {} if user_limits["tokens_remaining"] == float("inf") else {user_id: user_limits["tokens_remaining"]}
+    chats = {chat_id: get_chat(user_id, chat_id) for chat_id in chat_ids}
+    missing = sorted(chat_id for chat_id, chat in chats.items() if chat is None)
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Chat not found: {', '.join(missing[:10])}")
+    chat_budgets = {
+        (user_id, chat_id): check_chat_limits(chat)["chat_tokens_remaining"]
+        for chat_id, chat in chats.items()
+    }
+    return user_budgets, chat_budgets
+
+def result_or_error(result: dict, status_code: int = 400):
+    if "error" in result:
+        raise HTTPException(status_code=status_code, detail=result["error"])
+    return result
+
+
+@app.middleware("http")
+async def guest_id_header(request: Request, call_next):
+    """Return the guest id on every response (errors and streams included)"""
+    response = await call_next(request)
+    guest_id = getattr(request.state, "guest_id", None)
+    if guest_id:
+        response.headers["X-Guest-ID"] = guest_id
+    return response
+
+
+@app.on_event("startup")
+def on_startup():
+    if settings.warmup_on_startup:
+        start_warmup()
+
+
+@app.get("/health/live")
+def liveness():
+    return {"status": "ok"}
+
+
+@app.get("/health/ready")
+def readiness():
+    """Report which models and clients are warm (503 until all are)"""
+    report = get_readiness()
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
+
+@app.get("/metrics/redis")
+def redis_stats():
+    """Redis round trips, commands per round trip, latency and pool usage"""
+    return redis_metrics()
+
+
+@app.get("/metrics/singleflight")
+def coalescing_stats():
+    """How many duplicate in-flight computations were shared, per stage"""
+    return singleflight_stats()
+
+
+@app.get("/metrics/guest-reaper")
+def guest_reaper_stats():
+    """Guests, vectors, documents and Redis keys removed by the guest reaper"""
+    return reaper_stats()
+
+
+@app.get("/metrics/session-warmup")
+def session_warmup_metrics():
+    """Prefetch counts and warm-hit rates of the per-user session cache"""
+    return session_warmup_stats()
+
+
+@app.get("/chats/{chat_id}")
+def open_chat(chat_id: str, user_id: str = Depends(current_user_id)):
+    """Open a chat: recent history and limits (read through the session cache)"""
+    # The user-level warmup was already scheduled when the caller was identified
+    chat, chat_context = get_chat_state(user_id, chat_id)
+    if chat is None:
+        raise HTTPException(status_code=404, detail="Chat not found")
+    user_limits = check_user_limits(get_user_record(user_id) or {})
+    if user_limits["tokens_remaining"] == float("inf"):
+        user_limits["tokens_remaining"] = None  # paid users; inf is not valid JSON
+    return {
+        "chat_id": chat_id,
+        "title": chat.get("title", ""),
+        "chat_context": chat_context,
+        **user_limits,
+        **check_chat_limits(chat),
+    }
+
+
+@app.post("/documents", status_code=202)
+def upload_document(file: UploadFile = File(...), user_id: str = Depends(owner_user_id)):
+    """Save the upload and queue it for background ingestion"""
+    file_path = save_upload(user_id, file)
+    return {"job_id": enqueue_ingestion(user_id, file_path), "status": "queued"}
+
+
+@app.get("/documents/jobs/{job_id}")
+def ingestion_status(job_id: str, user_id: str = Depends(current_user_id)):
+    job = get_job(job_id)
+    if job is None or job["user_id"] != user_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.delete("/documents/{doc_id}")
+def remove_document(doc_id: str, user_id: str = Depends(current_user_id)):
+    return result_or_error(delete_document(user_id, doc_id), status_code=404)
+
+
+@app.put("/documents/{doc_id}", status_code=202)
+def update_document(doc_id: str, file: UploadFile = File(...), user_id: str = Depends(owner_user_id)):
+    """Queue a replacement of the document's content"""
+    file_path = save_upload(user_id, file)
+    return {"job_id": enqueue_ingestion(user_id, file_path, doc_id=doc_id), "status": "queued"}
+
+
+@app.post("/query/batch")
+async def batch_query(body: BatchQueryRequest, user_id: str = Depends(current_user_id)):
+    """Answer many questions against the caller's documents, streamed as NDJSON"""
+    user_budgets, chat_budgets = await asyncio.to_thread(token_budgets, user_id, {q.chat_id for q in body.items})
+    items = [{"user_id": user_id, "chat_id": q.chat_id, "prompt": q.prompt} for q in body.items]
+
+    async def stream():
+        async for result in abatch_query_rag_system(
+            items, body.max_concurrency, body.save_history, user_budgets=user_budgets, chat_budgets=chat_budgets
+        ):
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")